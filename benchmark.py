@@ -0,0 +1,328 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# Benchmarks for the searches over synthetic campus maps
+#
+# Usage:
+#   python benchmark.py                          # default sizes, print JSON
+#   python benchmark.py --sizes 100 1000000 --out results.json
+#   python benchmark.py --save-baseline baseline.json
+#   python benchmark.py --baseline baseline.json --tolerance 0.25
+#
+# Every map is generated from a fixed seed, written in the map file format
+# (with a coordinates file beside it), and loaded back through load_map, so
+# the numbers include the real loader. Each search engine then answers the
+# same query mix on it. The exhaustive searches only run on maps small
+# enough for them to finish. Engines that need something prepared first (a
+# contraction hierarchy, building positions) have it done before the clock
+# starts, and the time it took is reported separately as setupSeconds.
+#
+# Each engine answers the query mix several times and the fastest run is
+# reported, since a single run of a few milliseconds is mostly noise. For the
+# same reason, runs faster than a floor are left out of baseline comparisons.
+#
+
+import argparse
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+from hierarchy import *
+from traversal import *
+
+GRAPH_KINDS = ('grid', 'clustered', 'mixed')
+DEFAULT_SIZES = (25, 100, 1000, 10000)
+QUERIES_PER_MAP = 20
+DEFAULT_REPEATS = 5 ## runs of each engine; the fastest is reported
+DEFAULT_MIN_SECONDS = 0.05 ## runs faster than this are not compared
+LARGE_DIST = 1000000
+
+def gridEdges(n, rng):
+    # A square street grid; about a third of the blocks are walked outdoors
+    side = max(2, int(math.ceil(math.sqrt(n))))
+    for r in range(side):
+        for c in range(side):
+            node = r * side + c
+            if node >= n:
+                continue
+            for neighbor in (node + 1 if c + 1 < side else n, node + side):
+                if neighbor < n:
+                    total = rng.randint(10, 100)
+                    outdoor = total if rng.random() < 0.35 else 0
+                    yield node, neighbor, total, outdoor
+                    yield neighbor, node, total, outdoor
+
+def clusteredEdges(n, rng, clusterSize = 20):
+    # Buildings grouped into clusters joined by indoor corridors, with
+    # outdoor walkways from each cluster to its nearest neighbours
+    clusters = max(1, n // clusterSize)
+    places = clusterPlaces(clusters, rng)
+    members = [list(range(i, n, clusters)) for i in range(clusters)]
+    for group in members:
+        for i in range(len(group)):
+            a, b = group[i], group[(i + 1) % len(group)]
+            if a != b:
+                total = rng.randint(5, 60)
+                yield a, b, total, 0
+                yield b, a, total, 0
+            if len(group) > 3:
+                c = rng.choice(group)
+                if c != a:
+                    yield a, c, rng.randint(20, 120), 0
+    # Nearest neighbours on a coarse grid of cells, so this stays near-linear
+    cell = 1000.0 / max(1, int(math.sqrt(clusters)))
+    cells = {}
+    for i in range(clusters):
+        key = (int(places[i][0] // cell), int(places[i][1] // cell))
+        cells.setdefault(key, []).append(i)
+    for i in range(clusters):
+        x, y = places[i]
+        near = []
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                near.extend(cells.get((int(x // cell) + dx, int(y // cell) + dy), []))
+        near.sort(key=lambda j: (places[j][0] - x) ** 2 + (places[j][1] - y) ** 2)
+        for j in near[1:4]:
+            a = rng.choice(members[i])
+            b = rng.choice(members[j])
+            total = int(math.hypot(places[j][0] - x, places[j][1] - y)) + 10
+            outdoor = int(total * rng.uniform(0.5, 1.0))
+            yield a, b, total, outdoor
+            yield b, a, total, outdoor
+
+def clusterPlaces(clusters, rng):
+    # Where each cluster stands on a 1000 x 1000 campus
+    return [(rng.random() * 1000, rng.random() * 1000) for i in range(clusters)]
+
+def campusPositions(kind, n, rng, clusterSize = 20):
+    # Yields (building, x, y) for the buildings of a generated map. Grid
+    # buildings sit one unit apart; clustered ones stand where their
+    # cluster does, drawn from rng just as clusteredEdges draws them.
+    if kind == 'clustered':
+        clusters = max(1, n // clusterSize)
+        places = clusterPlaces(clusters, rng)
+        for node in range(n):
+            yield node, places[node % clusters][0], places[node % clusters][1]
+    else:
+        side = max(2, int(math.ceil(math.sqrt(n))))
+        for node in range(n):
+            yield node, node % side, node // side
+
+def mixedEdges(n, rng):
+    # A grid with some long indoor tunnels added as shortcuts
+    for edge in gridEdges(n, rng):
+        yield edge
+    for i in range(max(1, n // 50)):
+        a, b = rng.randrange(n), rng.randrange(n)
+        if a != b:
+            yield a, b, rng.randint(100, 400), 0
+
+def writeCampusMap(kind, n, mapFilename, seed = 0):
+    """
+    Generates a reproducible synthetic campus map with about n buildings
+    and writes it in the map file format, with the positions of its
+    buildings in mapFilename + '.coords'.
+
+    Returns:
+        the number of edges written
+    """
+    rng = random.Random('{0}-{1}-{2}'.format(kind, n, seed))
+    positions = campusPositions(kind, n, random.Random(\
+        '{0}-{1}-{2}'.format(kind, n, seed)))
+    outFile = open(mapFilename + '.coords', 'w')
+    try:
+        outFile.writelines(['{0} {1} {2}\n'.format(*position) \
+            for position in positions])
+    finally:
+        outFile.close()
+    generate = {'grid': gridEdges, 'clustered': clusteredEdges, \
+        'mixed': mixedEdges}[kind]
+    count = 0
+    outFile = open(mapFilename, 'w')
+    try:
+        lines = []
+        for src, dest, total, outdoor in generate(n, rng):
+            lines.append('{0} {1} {2} {3}\n'.format(src, dest, total, outdoor))
+            count += 1
+            if len(lines) >= 10000:
+                outFile.writelines(lines)
+                lines = []
+        outFile.writelines(lines)
+    finally:
+        outFile.close()
+    return count
+
+def queryMix(graph, count, seed = 0):
+    """
+    Picks a fixed mix of queries between random buildings: a third
+    unconstrained, a third with a tight outdoor budget, and a third with
+    a tight total budget.
+    """
+    rng = random.Random(seed)
+    names = graph.toCompact().names
+    queries = []
+    for i in range(count):
+        start, end = rng.choice(names), rng.choice(names)
+        if i % 3 == 0:
+            queries.append((start, end, LARGE_DIST, LARGE_DIST))
+        elif i % 3 == 1:
+            queries.append((start, end, LARGE_DIST, rng.choice((0, 50, 200))))
+        else:
+            queries.append((start, end, rng.choice((200, 500, 1000)), LARGE_DIST))
+    return queries
+
+def runEach(search):
+    # Adapts a one-query search to the engine interface (graph, queries),
+    # or (graph, queries, prepared) for a search taking what its engine's
+    # setup prepared as its second argument
+    def run(graph, queries, *prepared):
+        for start, end, maxTotal, maxOutdoors in queries:
+            try:
+                search(graph, *(prepared + (start, end, maxTotal, maxOutdoors)))
+            except ValueError:
+                pass
+    return run
+
+def withRoute(search):
+    # Adapts the searches that take a Path argument
+    def run(graph, start, end, maxTotal, maxOutdoors):
+        return search(graph, start, end, Path(start, end), maxTotal, maxOutdoors)
+    return run
+
+def prepareHierarchy(graph, mapFilename):
+    return buildHierarchy(graph)
+
+def prepareCoordinates(graph, mapFilename):
+    return load_coordinates(mapFilename).prepare(graph)
+
+## name: (function taking (graph, queries), largest map it is run on,
+## None or a setup taking (graph, mapFilename) whose result is passed to
+## the function as a third argument)
+ENGINES = {
+    'bruteForceSearch': (runEach(bruteForceSearch), 25, None),
+    'bruteForcePruneSearch': (runEach(withRoute(bruteForcePruneSearch)), 25, None),
+    'directedDFS': (runEach(withRoute(directedDFS)), 100, None),
+    'labelSettingSearch': (runEach(labelSettingSearch), None, None),
+    'bidirectionalSearch': (runEach(bidirectionalSearch), None, None),
+    'batchSearch': (batchSearch, None, None),
+    'hierarchySearch': (runEach(hierarchySearch), None, prepareHierarchy),
+    'aStarSearch': (runEach(aStarSearch), None, prepareCoordinates),
+}
+
+def benchmarkMap(kind, n, workDir, engines, seed = 0, repeats = DEFAULT_REPEATS):
+    """
+    Generates, loads and searches one map, running each engine repeats
+    times and keeping its fastest and median times.
+
+    Returns:
+        A list of result dicts, one per engine run on the map
+    """
+    mapFilename = os.path.join(workDir, '{0}-{1}.txt'.format(kind, n))
+    edges = writeCampusMap(kind, n, mapFilename, seed)
+    began = time.perf_counter()
+    graph = load_map(mapFilename)
+    loadSeconds = time.perf_counter() - began
+    queries = queryMix(graph, QUERIES_PER_MAP, seed)
+    results = []
+    for name in engines:
+        run, largest, setup = ENGINES[name]
+        if largest is not None and n > largest:
+            continue
+        began = time.perf_counter()
+        prepared = () if setup is None else (setup(graph, mapFilename),)
+        setupSeconds = time.perf_counter() - began
+        times = []
+        for i in range(repeats):
+            began = time.perf_counter()
+            run(graph, queries, *prepared)
+            times.append(time.perf_counter() - began)
+        times.sort()
+        seconds = times[0]
+        results.append({'graph': kind, 'nodes': n, 'edges': edges, \
+            'engine': name, 'queries': len(queries), 'seconds': seconds, \
+            'medianSeconds': times[len(times) // 2], 'repeats': repeats, \
+            'msPerQuery': 1000 * seconds / len(queries), \
+            'loadSeconds': loadSeconds, 'setupSeconds': setupSeconds})
+    os.remove(mapFilename)
+    os.remove(mapFilename + '.coords')
+    return results
+
+def compareToBaseline(results, baseline, tolerance, minSeconds = DEFAULT_MIN_SECONDS):
+    """
+    Returns a list of messages, one per engine run that took more than
+    (1 + tolerance) times its time in baseline. Runs that took less than
+    minSeconds are too short to tell a slowdown from noise, and are skipped.
+    """
+    previous = {}
+    for result in baseline['results']:
+        previous[(result['graph'], result['nodes'], result['engine'])] = result
+    regressions = []
+    for result in results:
+        old = previous.get((result['graph'], result['nodes'], result['engine']))
+        if old is None or result['seconds'] < minSeconds:
+            continue
+        if result['seconds'] > old['seconds'] * (1 + tolerance):
+            regressions.append('{0} on {1}-{2}: {3:.4f}s, baseline {4:.4f}s'.format(\
+                result['engine'], result['graph'], result['nodes'], \
+                result['seconds'], old['seconds']))
+    return regressions
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Benchmark the campus searches')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--kinds', nargs='+', choices=GRAPH_KINDS, default=GRAPH_KINDS)
+    parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), \
+        default=sorted(ENGINES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--out', help='write results here instead of stdout')
+    parser.add_argument('--baseline', help='fail if slower than these results')
+    parser.add_argument('--tolerance', type=float, default=0.25, \
+        help='allowed slowdown against the baseline (0.25 = 25%%)')
+    parser.add_argument('--min-seconds', type=float, default=DEFAULT_MIN_SECONDS, \
+        help='do not compare runs faster than this against the baseline')
+    parser.add_argument('--repeats', type=int, default=DEFAULT_REPEATS, \
+        help='run each engine this many times and report the fastest')
+    parser.add_argument('--save-baseline', help='also write results here')
+    args = parser.parse_args(argv)
+
+    results = []
+    workDir = tempfile.mkdtemp(prefix='campus-bench-')
+    try:
+        for kind in args.kinds:
+            for n in args.sizes:
+                results.extend(benchmarkMap(kind, n, workDir, args.engines, \
+                    args.seed, args.repeats))
+    finally:
+        os.rmdir(workDir)
+    report = {'python': platform.python_version(), 'platform': platform.platform(), \
+        'seed': args.seed, 'results': results}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        outFile = open(args.out, 'w')
+        outFile.write(text + '\n')
+        outFile.close()
+    else:
+        print(text)
+    if args.save_baseline:
+        outFile = open(args.save_baseline, 'w')
+        outFile.write(text + '\n')
+        outFile.close()
+    if args.baseline:
+        inFile = open(args.baseline)
+        baseline = json.load(inFile)
+        inFile.close()
+        regressions = compareToBaseline(results, baseline, args.tolerance, \
+            args.min_seconds)
+        for message in regressions:
+            print('REGRESSION', message, file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,9 +4,35 @@
 # A set of data structures to represent graphs
 #
 
+from array import array
+import itertools
+import json
+import math
+import mmap
+import os
+import struct
+import sys
+import time
+
+## Binary cache layout used by CompactDigraph.save/load: this header (48
+## bytes), the node names joined by newlines (padded to 8 bytes), then
+## offsets, totals, outdoors and targets as raw arrays, each starting on an
+## 8-byte boundary.
+CACHE_MAGIC = b'CMPGRPH2'
+CACHE_BYTE_ORDER = 1 if sys.byteorder == 'little' else 2
+CACHE_HEADER = struct.Struct('<8sBxxxIIxxxxQQQ')
+MAP_CHUNK_SIZE = 1 << 20
+LINE_MARK = '\x00' ## ends each line while a map chunk is split
+WRITE_BATCH_LINES = 10000
+COORDINATE_SCALE_MARGIN = 1 - 1e-9
+
 class Node(object):
+    __slots__ = ('name',)
     def __init__(self, name):
-        self.name = str(name)
+        # Interned, so nodes of the same name share one string, which keeps
+        # its hash cached and compares by identity first. Python frees an
+        # interned string once nothing refers to it any more.
+        self.name = sys.intern(str(name))
     def getName(self):
         return self.name
     def __str__(self):
@@ -20,9 +46,13 @@ class Node(object):
     def __hash__(self):
         # Override the default hash method
         # Think: Why would we want to do this?
-        return self.name.__hash__()
+        return hash(self.name)
+    def __reduce__(self):
+        # Rebuilt through __init__, so the receiving process interns the name
+        return (Node, (self.name,))
 
 class Edge(object):
+    __slots__ = ('src', 'dest')
     def __init__(self, src, dest):
         self.src = src
         self.dest = dest
@@ -35,6 +65,7 @@ class Edge(object):
 
 
 class WeightedEdge(Edge):
+    __slots__ = ('totalDistance', 'outdoorDistance')
     def __init__(self, src, dest, totalDistance = 1.0, outdoorDistance = 1.0):
         Edge.__init__(self, src, dest)
         self.totalDistance = float(totalDistance)
@@ -43,9 +74,15 @@ class WeightedEdge(Edge):
         return self.totalDistance
     def getOutdoorDistance(self):
         return self.outdoorDistance
+    def __getitem__(self, i):
+        # WeightedDigraph keeps the edges themselves as adjacency entries, so
+        # an edge also reads as the entry [dest, (tot, outs)]
+        return (self.dest, (self.totalDistance, self.outdoorDistance))[i]
     def __str__(self):
         return str(self.src) + '->' + str(self.dest) +' ('\
             + str(self.totalDistance) + ', ' + str(self.outdoorDistance) + ')'
+    def __repr__(self):
+        return self.__str__()
 
 class Digraph(object):
     """
@@ -77,11 +114,8 @@ class Digraph(object):
     def hasNode(self, node):
         return node in self.nodes
     def __str__(self):
-        res = ''
-        for k in self.edges:
-            for d in self.edges[k]:
-                res = '{0}{1}->{2}\n'.format(res, k, d)
-        return res[:-1]
+        return '\n'.join('{0}->{1}'.format(k, d) \
+            for k in self.edges for d in self.edges[k])
         
 class WeightedDigraph(Digraph):
     """
@@ -91,7 +125,13 @@ class WeightedDigraph(Digraph):
         self.nodes = set([])
         self.nodeTable = {} ## stores nodeName:Node pairs
         self.edges = {}
-        self.edgeTable = {} ## stores (sourceNode, destNode):Edge pairs
+        self.parents = {} ## stores node:edges into it, the reverse of edges
+        self.edgeTable = {} ## stores edgeKey(sourceNode, destNode):Edge pairs
+        self.nodeIds = {} ## stores node:id pairs, numbering nodes for edgeTable keys
+        self.nextNodeId = 0 ## ids are never reused, even after removeNode
+        self.compact = None ## CompactDigraph snapshot, rebuilt after changes
+        self.version = 0 ## bumped by every change to the nodes or edges
+        self.changeLog = [] ## stores (version, kind, srcName, destName), oldest first
     def addEdge(self, edge):  ## Note that the problem expects weights to be
                               ## a tuple of floats, but that the destination node
                               ## should not be included in this tuple; rather dest
@@ -99,16 +139,25 @@ class WeightedDigraph(Digraph):
                               ## Both dest and (tot, outs), should be in their own
                               ## list.
                               ## Thus, [dest, (tot, outs)]
+                              ## The WeightedEdge itself reads as that list, so
+                              ## it is stored once and shared with getEdge.
         src = edge.getSource()
         dest = edge.getDestination()
-        tot = edge.getTotalDistance()
-        outs = edge.getOutdoorDistance()
         if not(src in self.nodes and dest in self.nodes):
             raise ValueError('Node not in graph')
-        self.edges[src].append([dest, (tot, outs)])
-        self.edgeTable[(src,dest)] = edge
+        self.edges[src].append(edge)
+        self.parents[dest].append(edge)
+        self.edgeTable[self.edgeKey(src, dest)] = edge
+        self.logChange('better')
+    def edgeKey(self, src, dest):
+        # The edgeTable key of the edge from node src to node dest, or None
+        # if either node is not in the graph
+        try:
+            return self.nodeIds[src] << 32 | self.nodeIds[dest]
+        except KeyError:
+            return None
     def getEdge(self, src, dest):
-        return self.edgeTable[(src, dest)]
+        return self.edgeTable[self.edgeKey(src, dest)]
     def addNode(self, node):
         if node in self.nodes:
             raise ValueError("Duplicate node")
@@ -116,6 +165,97 @@ class WeightedDigraph(Digraph):
             self.nodes.add(node)
             self.nodeTable[node.getName()] = node
             self.edges[node] = []
+            self.parents[node] = []
+            self.nodeIds[node] = self.nextNodeId
+            self.nextNodeId += 1
+            self.logChange('nodeAdded', node.getName())
+    def removeEdge(self, src, dest):
+        """
+        Removes the edge from node src to node dest (every copy of it, if it
+        was added more than once).
+        """
+        if self.edgeKey(src, dest) not in self.edgeTable:
+            raise ValueError('Edge not in graph')
+        del self.edgeTable[self.edgeKey(src, dest)]
+        self.edges[src] = replaceEdges(self.edges[src], src, dest, None)
+        self.parents[dest] = replaceEdges(self.parents[dest], src, dest, None)
+        self.logChange('worse', src.getName(), dest.getName())
+    def updateEdge(self, src, dest, totalDistance, outdoorDistance):
+        """
+        Gives the edge from node src to node dest new weights. If the edge
+        was added more than once, the copies are replaced by a single one.
+        """
+        if self.edgeKey(src, dest) not in self.edgeTable:
+            raise ValueError('Edge not in graph')
+        edge = WeightedEdge(src, dest, totalDistance, outdoorDistance)
+        # Routes can only get worse if some old copy of the edge was at least
+        # as short on both distances as the new one
+        worse = False
+        for old in self.edges[src]:
+            if old.dest == dest and old.totalDistance <= edge.totalDistance \
+                and old.outdoorDistance <= edge.outdoorDistance:
+                worse = True
+        self.edges[src] = replaceEdges(self.edges[src], src, dest, edge)
+        self.parents[dest] = replaceEdges(self.parents[dest], src, dest, edge)
+        self.edgeTable[self.edgeKey(src, dest)] = edge
+        if worse:
+            self.logChange('worse', src.getName(), dest.getName())
+        else:
+            self.logChange('better')
+    def removeNode(self, node):
+        """
+        Removes node along with every edge into or out of it.
+        """
+        if node not in self.nodes:
+            raise ValueError('Node not in graph')
+        for edge in self.parents[node]:
+            src = edge.src
+            if self.edgeKey(src, node) in self.edgeTable:
+                del self.edgeTable[self.edgeKey(src, node)]
+                if src != node:
+                    self.edges[src] = replaceEdges(self.edges[src], src, node, None)
+                self.logChange('worse', src.getName(), node.getName())
+        for edge in self.edges[node]:
+            dest = edge.dest
+            if self.edgeKey(node, dest) in self.edgeTable:
+                del self.edgeTable[self.edgeKey(node, dest)]
+                self.parents[dest] = replaceEdges(self.parents[dest], node, dest, None)
+                self.logChange('worse', node.getName(), dest.getName())
+        del self.edges[node]
+        del self.parents[node]
+        del self.nodeTable[node.getName()]
+        del self.nodeIds[node]
+        self.nodes.remove(node)
+        self.logChange('nodeRemoved', node.getName())
+    def logChange(self, kind, srcName = None, destName = None):
+        # kind is 'worse' when the edge srcName->destName was removed or made
+        # longer, so only routes through it are affected; 'better' when edges
+        # were added or made shorter, which can affect any route;
+        # 'nodeAdded' when the node srcName was added, which affects no route
+        # until edges to it are; and 'nodeRemoved' when the node srcName was
+        # removed (after its edges).
+        self.version += 1
+        self.compact = None
+        if kind == 'better' and self.changeLog and self.changeLog[-1][1] == kind:
+            # A run of additions needs only one entry, since any one of them
+            # already affects every route
+            self.changeLog[-1] = (self.version, kind, None, None)
+        else:
+            self.changeLog.append((self.version, kind, srcName, destName))
+    def getVersion(self):
+        return self.version
+    def changesSince(self, version):
+        """
+        Returns the changeLog entries made after version, oldest first, for
+        caches to bring themselves up to date with the graph.
+        """
+        changes = []
+        for entry in reversed(self.changeLog):
+            if entry[0] <= version:
+                break
+            changes.append(entry)
+        changes.reverse()
+        return changes
     def getNode(self, nodeName):
         return self.nodeTable[nodeName]            
     def hasNode(self, node):
@@ -124,11 +264,24 @@ class WeightedDigraph(Digraph):
         return nodeName in self.nodeTable
     def childrenOf(self, node):
         children = []
-        for entry in self.edges[node]:
-            children.append(entry[0])
+        for edge in self.edges[node]:
+            children.append(edge.dest)
         return children
+    def parentsOf(self, node):
+        parents = []
+        for edge in self.parents[node]:
+            parents.append(edge.src)
+        return parents
     def hasChildNodes(self, node):
         return len(self.edges[node]) > 0
+    def toCompact(self):
+        """
+        Returns a CompactDigraph with the same nodes and edges. The snapshot is
+        kept until the graph changes, so repeated searches share it.
+        """
+        if self.compact is None:
+            self.compact = CompactDigraph.fromWeightedDigraph(self)
+        return self.compact
     def getTotalDistance(self, path):
         total = 0
         for i in range(len(path) - 1):
@@ -147,21 +300,643 @@ class WeightedDigraph(Digraph):
     def pathMeetsBothConstraints(self, path, maxTotalDistance, maxOutdoorDistance):
         return self.getTotalDistance(path) <= maxTotalDistance \
                 and self.getOutdoorDistance(path) <= maxOutdoorDistance
+    ## Batch versions of the above, for paths of node indices as numbered in
+    ## toCompact() (see CompactDigraph.evaluatePaths); they need NumPy
+    def pathIndices(self, paths):
+        return self.toCompact().pathIndices(paths)
+    def evaluatePaths(self, paths):
+        return self.toCompact().evaluatePaths(paths)
+    def pathsMeetBothConstraints(self, paths, maxTotalDistance, maxOutdoorDistance):
+        return self.toCompact().pathsMeetBothConstraints(paths, \
+            maxTotalDistance, maxOutdoorDistance)
+    def pathsFailEitherConstraint(self, paths, maxTotalDistance, maxOutdoorDistance):
+        return self.toCompact().pathsFailEitherConstraint(paths, \
+            maxTotalDistance, maxOutdoorDistance)
+    def edgeRecords(self):
+        # Yields (srcName, destName, tot, outs) for every edge, a node's
+        # edges in the order they were added
+        for node in self.edges:
+            for edge in self.edges[node]:
+                yield node.name, edge.dest.name, edge.totalDistance, \
+                    edge.outdoorDistance
     def __str__(self):
-        res = ''
-        for k in self.edges:
-            for d in self.edges[k]:
-                res = '{0}{1}->{2} ({3}, {4})\n'.format(res, k, d[0], \
-                float(d[1][0]), float(d[1][1]))
-        return res[:-1]
+        return '\n'.join('{0}->{1} ({2}, {3})'.format(src, dest, \
+            float(tot), float(outs)) for src, dest, tot, outs in self.edgeRecords())
+
+def replaceEdges(edges, src, dest, edge):
+    """
+    Returns a copy of the list edges with the first edge from src to dest
+    replaced by edge and any others from src to dest dropped, or with every
+    edge from src to dest dropped if edge is None.
+    """
+    result = []
+    for old in edges:
+        if old.src != src or old.dest != dest:
+            result.append(old)
+        elif edge is not None:
+            result.append(edge)
+            edge = None
+    return result
+
+class CompactDigraph(object):
+    """
+    A frozen, array-backed weighted digraph in compressed sparse row form.
+
+    Nodes are numbered 0..n-1 in the order they were first seen. The edges
+    leaving node i are stored contiguously at positions
+    offsets[i]..offsets[i+1]-1 of targets (destination indices), totals and
+    outdoors (float64 weights), so one edge costs 20 bytes instead of the
+    several Python objects WeightedDigraph keeps for it.
+    """
+    def __init__(self, names, offsets, targets, totals, outdoors):
+        self.names = names ## stores index:nodeName
+        self.index = {} ## stores nodeName:index pairs
+        for i in range(len(names)):
+            self.index[names[i]] = i
+        self.offsets = offsets
+        self.targets = targets
+        self.totals = totals
+        self.outdoors = outdoors
+        self.reverse = None ## the reversed graph, built on first use
+        self.edgeKeys = None ## NumPy edge lookup for evaluatePaths, built on first use
+    @classmethod
+    def fromEdges(cls, names, sources, targets, totals, outdoors):
+        """
+        Builds a CompactDigraph from parallel edge sequences, where sources
+        and targets hold node indices into names. Edges leaving the same node
+        keep their relative order.
+        """
+        counts = array('q', bytes(8 * (len(names) + 1)))
+        for src in sources:
+            counts[src + 1] += 1
+        for i in range(len(names)):
+            counts[i + 1] += counts[i]
+        offsets = array('q', counts)
+        position = counts
+        sortedTargets = array('i', bytes(4 * len(sources)))
+        sortedTotals = array('d', bytes(8 * len(sources)))
+        sortedOutdoors = array('d', bytes(8 * len(sources)))
+        for e in range(len(sources)):
+            slot = position[sources[e]]
+            position[sources[e]] = slot + 1
+            sortedTargets[slot] = targets[e]
+            sortedTotals[slot] = totals[e]
+            sortedOutdoors[slot] = outdoors[e]
+        return cls(names, offsets, sortedTargets, sortedTotals, sortedOutdoors)
+    @classmethod
+    def fromWeightedDigraph(cls, digraph):
+        names = list(digraph.nodeTable)
+        index = {}
+        for i in range(len(names)):
+            index[names[i]] = i
+        offsets = array('q', [0])
+        targets = array('i')
+        totals = array('d')
+        outdoors = array('d')
+        for name in names:
+            for edge in digraph.edges[digraph.nodeTable[name]]:
+                targets.append(index[edge.dest.name])
+                totals.append(edge.totalDistance)
+                outdoors.append(edge.outdoorDistance)
+            offsets.append(len(targets))
+        return cls(names, offsets, targets, totals, outdoors)
+    @classmethod
+    def fromMapFile(cls, mapFile):
+        """
+        Reads a map file (From To TotalDistance DistanceOutdoors per line)
+        straight into arrays, without creating Node or WeightedEdge objects.
+        mapFile may be a filename or an open text file.
+        """
+        return cls.fromEdges(*readMapEdges(mapFile))
+    @classmethod
+    def load(cls, cacheFilename):
+        """
+        Memory-maps a file written by save(). The offset, target and weight
+        arrays are views straight onto the mapped pages, so nothing but the
+        node names is copied into Python objects.
+
+        Returns:
+            A tuple (compact, sourceStamp), where sourceStamp is the value
+            given to save(). Raises ValueError if the file is not a cache.
+        """
+        inFile = open(cacheFilename, 'rb')
+        try:
+            buf = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            inFile.close()
+        if len(buf) < CACHE_HEADER.size:
+            raise ValueError('Not a map cache file')
+        magic, order, numNodes, numEdges, namesSize, size, mtime = \
+            CACHE_HEADER.unpack_from(buf, 0)
+        if magic != CACHE_MAGIC or order != CACHE_BYTE_ORDER:
+            raise ValueError('Not a map cache file')
+        start = CACHE_HEADER.size
+        if len(buf) != start + (namesSize + 7) // 8 * 8 \
+            + (numNodes + 1) * 8 + numEdges * 20:
+            raise ValueError('Map cache file has the wrong size')
+        view = memoryview(buf)
+        names = bytes(view[start:start + namesSize]).decode('utf-8')
+        names = names.split('\n') if numNodes else []
+        start += (namesSize + 7) // 8 * 8
+        def section(typecode, count, itemSize):
+            return view[start:start + count * itemSize].cast(typecode)
+        offsets = section('q', numNodes + 1, 8)
+        start += (numNodes + 1) * 8
+        totals = section('d', numEdges, 8)
+        start += numEdges * 8
+        outdoors = section('d', numEdges, 8)
+        start += numEdges * 8
+        targets = section('i', numEdges, 4)
+        compact = cls(names, offsets, targets, totals, outdoors)
+        compact.buffer = buf
+        return compact, (size, mtime)
+    def save(self, cacheFilename, sourceStamp = (0, 0)):
+        """
+        Writes the arrays to a binary file that load() can memory-map.
+        sourceStamp is a (size, mtime) pair describing the map file the graph
+        came from, so a stale cache can be told apart from a fresh one.
+        """
+        names = '\n'.join(self.names).encode('utf-8')
+        # Written beside the target and renamed over it, so that a process
+        # still mapping the old cache never sees the file truncated
+        tempFilename = cacheFilename + '.tmp'
+        outFile = open(tempFilename, 'wb')
+        try:
+            outFile.write(CACHE_HEADER.pack(CACHE_MAGIC, CACHE_BYTE_ORDER, \
+                self.numNodes(), self.numEdges(), len(names), \
+                sourceStamp[0], sourceStamp[1]))
+            outFile.write(names)
+            outFile.write(bytes(-len(names) % 8))
+            for values, typecode in ((self.offsets, 'q'), (self.totals, 'd'), \
+                (self.outdoors, 'd'), (self.targets, 'i')):
+                outFile.write(array(typecode, values).tobytes())
+        finally:
+            outFile.close()
+        os.replace(tempFilename, cacheFilename)
+    def toWeightedDigraph(self):
+        """
+        Builds the equivalent WeightedDigraph, which keeps this object as its
+        compact snapshot.
+        """
+        g = WeightedDigraph()
+        nodes = []
+        for name in self.names:
+            nodes.append(Node(name))
+            g.addNode(nodes[-1])
+        # Maps repeat the same few distances, so edges share their floats
+        distances = {}
+        for i in range(len(nodes)):
+            for e in self.edgeRange(i):
+                tot = self.totals[e]
+                outs = self.outdoors[e]
+                g.addEdge(WeightedEdge(nodes[i], nodes[self.targets[e]], \
+                    distances.setdefault(tot, tot), distances.setdefault(outs, outs)))
+        # The new graph matches its map file, so its history starts here
+        g.version = 0
+        g.changeLog = []
+        g.compact = self
+        return g
+    def __getstate__(self):
+        # Memory-mapped arrays cannot be pickled, so send plain copies
+        state = self.__dict__.copy()
+        state.pop('buffer', None)
+        state['reverse'] = None
+        state['edgeKeys'] = None
+        for key, typecode in (('offsets', 'q'), ('targets', 'i'), \
+            ('totals', 'd'), ('outdoors', 'd')):
+            state[key] = array(typecode, state[key])
+        return state
+    def toCompact(self):
+        return self
+    def getVersion(self):
+        # A CompactDigraph never changes
+        return 0
+    def changesSince(self, version):
+        return []
+    def getReverse(self):
+        """
+        Returns the CompactDigraph with every edge turned around, with the
+        same node indices. It is built once and kept.
+        """
+        if self.reverse is None:
+            sources = array('i', bytes(4 * self.numEdges()))
+            for i in range(self.numNodes()):
+                for e in self.edgeRange(i):
+                    sources[e] = i
+            self.reverse = CompactDigraph.fromEdges(self.names, self.targets, \
+                sources, self.totals, self.outdoors)
+            self.reverse.reverse = self
+        return self.reverse
+    def numNodes(self):
+        return len(self.names)
+    def numEdges(self):
+        return len(self.targets)
+    def getIndex(self, nodeName):
+        return self.index[nodeName]
+    def getName(self, i):
+        return self.names[i]
+    def hasNodeName(self, nodeName):
+        return nodeName in self.index
+    def edgeRange(self, i):
+        # Positions in targets/totals/outdoors of the edges leaving node i
+        return range(self.offsets[i], self.offsets[i + 1])
+    def childrenOf(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+    def parentsOf(self, i):
+        return self.getReverse().childrenOf(i)
+    def edgeRecords(self):
+        # Yields (srcName, destName, tot, outs) for every edge, as
+        # WeightedDigraph.edgeRecords does
+        names = self.names
+        for i in range(self.numNodes()):
+            for e in self.edgeRange(i):
+                yield names[i], names[self.targets[e]], self.totals[e], \
+                    self.outdoors[e]
+    def findEdge(self, src, dest):
+        # Position of the edge from index src to index dest; like getEdge on
+        # WeightedDigraph, the last one added wins if there are several
+        for e in reversed(self.edgeRange(src)):
+            if self.targets[e] == dest:
+                return e
+        raise KeyError((src, dest))
+    def getTotalDistance(self, path):
+        total = 0
+        for i in range(len(path) - 1):
+            total += self.totals[self.findEdge(self.index[path[i]], \
+                self.index[path[i+1]])]
+        return total
+    def getOutdoorDistance(self, path):
+        outdoors = 0
+        for i in range(len(path) - 1):
+            outdoors += self.outdoors[self.findEdge(self.index[path[i]], \
+                self.index[path[i+1]])]
+        return outdoors
+    def pathIndices(self, paths):
+        """
+        Turns paths given as lists of building numbers (strings) into the
+        lists of node indices evaluatePaths takes.
+        """
+        index = self.index
+        return [[index[name] for name in path] for path in paths]
+    def getEdgeKeys(self):
+        # Returns (keys, positions): every edge's src * n + dest in sorted
+        # order, and where that edge is stored. Equal keys keep their stored
+        # order, so the last of them is the one findEdge would return
+        if self.edgeKeys is None:
+            numpy = importNumpy()
+            n = self.numNodes()
+            offsets = numpy.frombuffer(self.offsets, dtype=numpy.int64)
+            sources = numpy.repeat(numpy.arange(n, dtype=numpy.int64), \
+                numpy.diff(offsets))
+            keys = sources * n + numpy.frombuffer(self.targets, dtype=numpy.int32)
+            positions = numpy.argsort(keys, kind='stable')
+            self.edgeKeys = (keys[positions], positions)
+        return self.edgeKeys
+    def evaluatePaths(self, paths):
+        """
+        Computes the total and outdoor distance of many paths at once, with
+        NumPy operations over the edge weight arrays instead of a Python loop
+        per step.
+
+        Parameters:
+            paths: a sequence of paths, each a sequence (or NumPy array) of
+                node indices; see pathIndices
+
+        Returns:
+            A tuple (totals, outdoors) of NumPy float arrays, with one entry
+            per path. Raises KeyError if a path takes an edge that is not in
+            the graph, or names a node index out of range.
+        """
+        numpy = importNumpy()
+        keys, positions = self.getEdgeKeys()
+        n = self.numNodes()
+        lengths = numpy.fromiter(map(len, paths), dtype=numpy.int64, \
+            count=len(paths))
+        nodes = numpy.fromiter(itertools.chain.from_iterable(paths), \
+            dtype=numpy.int64, count=int(lengths.sum()))
+        # Step i goes from nodes[i] to nodes[i + 1], unless nodes[i] is the
+        # last node of its path
+        pathIds = numpy.repeat(numpy.arange(len(paths)), lengths)
+        steps = pathIds[:-1] == pathIds[1:]
+        srcs, dests = nodes[:-1][steps], nodes[1:][steps]
+        # An index out of range would otherwise make the key of another edge
+        outside = (srcs < 0) | (srcs >= n) | (dests < 0) | (dests >= n)
+        if outside.any():
+            step = numpy.flatnonzero(outside)[0]
+            raise KeyError((int(srcs[step]), int(dests[step])))
+        wanted = srcs * n + dests
+        found = numpy.searchsorted(keys, wanted, side='right') - 1
+        if len(keys) == 0:
+            missing = numpy.ones(len(wanted), dtype=bool)
+        else:
+            missing = (found < 0) | (keys[numpy.maximum(found, 0)] != wanted)
+        if missing.any():
+            step = numpy.flatnonzero(missing)[0]
+            raise KeyError((int(wanted[step] // n), int(wanted[step] % n)))
+        edges = positions[found]
+        stepPaths = pathIds[:-1][steps]
+        totals = numpy.bincount(stepPaths, minlength=len(paths), \
+            weights=numpy.frombuffer(self.totals, dtype=numpy.float64)[edges])
+        outdoors = numpy.bincount(stepPaths, minlength=len(paths), \
+            weights=numpy.frombuffer(self.outdoors, dtype=numpy.float64)[edges])
+        return totals.astype(numpy.float64, copy=False), \
+            outdoors.astype(numpy.float64, copy=False)
+    def pathsMeetBothConstraints(self, paths, maxTotalDistance, maxOutdoorDistance):
+        # Boolean NumPy array: which of paths are within both limits
+        totals, outdoors = self.evaluatePaths(paths)
+        return (totals <= maxTotalDistance) & (outdoors <= maxOutdoorDistance)
+    def pathsFailEitherConstraint(self, paths, maxTotalDistance, maxOutdoorDistance):
+        return ~self.pathsMeetBothConstraints(paths, maxTotalDistance, \
+            maxOutdoorDistance)
+    def __str__(self):
+        return '<CompactDigraph: {0} nodes, {1} edges>'.format(\
+            self.numNodes(), self.numEdges())
+
+def importNumpy():
+    # NumPy is optional: only the batch path evaluation needs it
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Evaluating paths in batches needs NumPy')
+    return numpy
+
+def splitMapLines(lines):
+    # Splits complete map file lines into their four columns. A marker token
+    # is put at the end of every line, so one bulk split() both parses the
+    # lines and shows whether each had 4 fields: the markers must then be
+    # every fifth token. Only if they are not (a blank line, or a line of the
+    # wrong length) are the lines looked at one by one, to skip blank ones
+    # or report the bad one.
+    if lines and not lines.endswith('\n'):
+        lines += '\n'
+    if LINE_MARK not in lines:
+        tokens = lines.replace('\n', ' ' + LINE_MARK + ' ').split()
+        rows = len(tokens) // 5
+        if len(tokens) == 5 * rows and rows == lines.count('\n') \
+            and tokens[4::5].count(LINE_MARK) == rows:
+            return tokens[0::5], tokens[1::5], tokens[2::5], tokens[3::5]
+    tokens = []
+    for line in lines.splitlines():
+        fields = line.split()
+        if fields and len(fields) != 4:
+            raise ValueError('Map file lines must have 4 fields: {0!r}'.format(line))
+        tokens.extend(fields)
+    return tokens[0::4], tokens[1::4], tokens[2::4], tokens[3::4]
+
+def readMapEdges(mapFile):
+    """
+    Parses a map file in bulk chunks rather than line by line.
+
+    Parameters:
+        mapFile: a filename or an open text file, where each line is
+            From To TotalDistance DistanceOutdoors
+
+    Returns:
+        A tuple (names, sources, targets, totals, outdoors), where names lists
+        the buildings in the order they first appear and the other four are
+        parallel arrays describing one edge each, by index into names.
+    """
+    if hasattr(mapFile, 'read'):
+        inFile = mapFile
+    else:
+        inFile = open(mapFile, 'r')
+    index = {} ## stores nodeName:index pairs
+    sources = array('i')
+    targets = array('i')
+    totals = array('d')
+    outdoors = array('d')
+    leftover = ''
+    try:
+        while True:
+            chunk = inFile.read(MAP_CHUNK_SIZE)
+            if chunk:
+                # Only parse complete lines; the tail waits for the next chunk
+                cut = chunk.rfind('\n') + 1
+                if not cut:
+                    leftover += chunk
+                    continue
+                lines = leftover + chunk[:cut]
+                leftover = chunk[cut:]
+            else:
+                lines = leftover
+            srcNames, destNames, lineTotals, lineOutdoors = splitMapLines(lines)
+            endsInLineOrder = [None] * (2 * len(srcNames))
+            endsInLineOrder[0::2] = srcNames
+            endsInLineOrder[1::2] = destNames
+            ids = [index.setdefault(name, len(index)) for name in endsInLineOrder]
+            sources.extend(ids[0::2])
+            targets.extend(ids[1::2])
+            totals.extend(map(float, lineTotals))
+            outdoors.extend(map(float, lineOutdoors))
+            if not chunk:
+                break
+    finally:
+        if inFile is not mapFile:
+            inFile.close()
+    return list(index), sources, targets, totals, outdoors
+
+def formatDistance(distance):
+    # Whole distances are written without a decimal point, as map files
+    # have them; anything else keeps every digit
+    if float(distance).is_integer():
+        return str(int(distance))
+    return repr(float(distance))
+
+def jsonDistance(distance):
+    # JSON has no infinity or NaN, so those distances are written as null
+    if math.isfinite(distance):
+        return formatDistance(distance)
+    return 'null'
+
+def mapLines(graph):
+    # Lines of the map file format, From To TotalDistance DistanceOutdoors
+    for src, dest, tot, outs in graph.edgeRecords():
+        if len(src.split()) != 1 or len(dest.split()) != 1:
+            raise ValueError('Map files cannot hold the node name ' + \
+                repr(src if len(src.split()) != 1 else dest))
+        yield '{0} {1} {2} {3}\n'.format(src, dest, formatDistance(tot), \
+            formatDistance(outs))
+
+def jsonLines(graph):
+    # One JSON object per edge
+    quoted = {} ## stores nodeName:JSON string pairs
+    for src, dest, tot, outs in graph.edgeRecords():
+        if src not in quoted:
+            quoted[src] = json.dumps(src)
+        if dest not in quoted:
+            quoted[dest] = json.dumps(dest)
+        yield '{{"from": {0}, "to": {1}, "total": {2}, "outdoor": {3}}}\n'.format(\
+            quoted[src], quoted[dest], jsonDistance(tot), jsonDistance(outs))
+
+def dotLines(graph):
+    # A GraphViz digraph, each edge labelled total/outdoor. The distances are
+    # quoted, since inf or nan would not be valid unquoted DOT IDs
+    yield 'digraph campus {\n'
+    quoted = {} ## stores nodeName:DOT ID pairs; JSON strings are valid ones
+    for src, dest, tot, outs in graph.edgeRecords():
+        if src not in quoted:
+            quoted[src] = json.dumps(src)
+        if dest not in quoted:
+            quoted[dest] = json.dumps(dest)
+        tot = formatDistance(tot)
+        outs = formatDistance(outs)
+        yield '  {0} -> {1} [label="{2}/{3}", total="{2}", outdoor="{3}"];\n'.format(\
+            quoted[src], quoted[dest], tot, outs)
+    yield '}\n'
+
+## format name: generator of the lines writeGraph writes
+EXPORT_FORMATS = {'map': mapLines, 'jsonl': jsonLines, 'dot': dotLines}
+
+def writeGraph(graph, outFile, fileFormat = 'map'):
+    """
+    Streams the edges of a graph to a file, a batch of lines at a time, so
+    no more than one batch is ever held as text.
+
+    Parameters:
+        graph: a WeightedDigraph or CompactDigraph
+        outFile: a filename or an open text file. A named file is written
+            beside its final name and renamed over it once complete.
+        fileFormat: 'map' for the map file format, which load_map reads back,
+            'jsonl' for JSON Lines, or 'dot' for GraphViz
+
+    Assumes:
+        Only edges are written, as in map files, so nodes without edges
+        are left out. In the map format node names cannot contain spaces.
+
+    Returns:
+        the number of lines written
+    """
+    lines = EXPORT_FORMATS[fileFormat](graph)
+    if hasattr(outFile, 'write'):
+        return writeLines(lines, outFile)
+    tempFilename = outFile + '.tmp'
+    tempFile = open(tempFilename, 'w')
+    try:
+        try:
+            count = writeLines(lines, tempFile)
+        finally:
+            tempFile.close()
+    except BaseException:
+        os.remove(tempFilename)
+        raise
+    os.replace(tempFilename, outFile)
+    return count
+
+def writeLines(lines, outFile):
+    count = 0
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= WRITE_BATCH_LINES:
+            outFile.writelines(batch)
+            count += len(batch)
+            batch = []
+    outFile.writelines(batch)
+    return count + len(batch)
+
+def readCoordinates(coordFile):
+    """
+    Parses a coordinates file, the optional companion of a map file.
+
+    Parameters:
+        coordFile: a filename or an open text file, where each line is
+            Building X Y
+        giving the position of one building, in any unit of length
+
+    Returns:
+        A dict mapping building numbers (strings) to (x, y) tuples of floats
+    """
+    if hasattr(coordFile, 'read'):
+        inFile = coordFile
+    else:
+        inFile = open(coordFile, 'r')
+    positions = {}
+    try:
+        for line in inFile:
+            fields = line.split()
+            if not fields:
+                continue
+            if len(fields) != 3:
+                raise ValueError('Coordinates file lines must have 3 fields')
+            positions[sys.intern(fields[0])] = (float(fields[1]), float(fields[2]))
+    finally:
+        if inFile is not coordFile:
+            inFile.close()
+    return positions
+
+class Coordinates(object):
+    """
+    Building positions, from which a search can bound the total distance
+    still to go. Straight-line distance only bounds it once scaled by the
+    smallest ratio of an edge's total distance to the distance between its
+    ends, which does not depend on the units used. prepare() works the
+    scale out for a graph and keeps it until the graph changes.
+    """
+    def __init__(self, positions):
+        self.positions = positions ## stores nodeName:(x, y) pairs
+        self.graph = None ## the CompactDigraph xs, ys and scale were made for
+        self.xs = None ## stores index:x for the nodes of graph
+        self.ys = None ## stores index:y for the nodes of graph
+        self.scale = 0.0
+    def hasNodeName(self, nodeName):
+        return nodeName in self.positions
+    def getPosition(self, nodeName):
+        return self.positions[nodeName]
+    def prepare(self, digraph):
+        """
+        Lays the positions out by node index for the CompactDigraph form of
+        digraph and finds the scale for it.
+
+        Returns:
+            self. Raises ValueError if a building of digraph has no position.
+        """
+        graph = digraph.toCompact()
+        if graph is self.graph:
+            return self
+        xs = array('d')
+        ys = array('d')
+        for name in graph.names:
+            if name not in self.positions:
+                raise ValueError('No position for building ' + name)
+            x, y = self.positions[name]
+            xs.append(x)
+            ys.append(y)
+        scale = float('inf')
+        for i in range(graph.numNodes()):
+            for e in graph.edgeRange(i):
+                straight = math.hypot(xs[graph.targets[e]] - xs[i], \
+                    ys[graph.targets[e]] - ys[i])
+                if graph.totals[e] < scale * straight:
+                    scale = graph.totals[e] / straight
+        if scale == float('inf'):
+            scale = 0.0 ## no edge goes anywhere, so nothing can be bounded
+        # Shaved a little so rounding can never push a bound past the truth
+        self.scale = scale * COORDINATE_SCALE_MARGIN
+        self.xs, self.ys, self.graph = xs, ys, graph
+        return self
 
 class Path(object):
-    def __init__(self):
-        self.deadNodes = []
-        self.steps = 0
+    """
+    Instrumentation for depth-first searches: the nodes found to be dead
+    ends, and counters of the work done, so search strategies can be
+    compared. One Path can be shared by several searches, whose counts and
+    wall time then add up.
+    """
+    def __init__(self, start = None, end = None):
+        self.start = start
+        self.end = end
+        self.deadNodes = set([])
+        self.deadOrder = [] ## dead nodes in the order they were marked
+        self.steps = 0 ## nodes expanded
+        self.prunedByBudget = 0
+        self.prunedByBound = 0
+        self.prunedByDeadNode = 0
+        self.wallTime = 0.0
+        self.timerStart = None
     def markNodeDead(self, node):
         if node not in self.deadNodes:
-            self.deadNodes.append(node)
+            self.deadNodes.add(node)
+            self.deadOrder.append(node)
         else:
             raise ValueError("Node already in deadNodes")
     def isDeadNode(self, node):
@@ -170,8 +945,39 @@ class Path(object):
         self.steps += 1
     def getSteps(self):
         return self.steps
+    def getNodesExpanded(self):
+        return self.steps
     def getDeadNodes(self):
-        return self.deadNodes[:]
+        return self.deadOrder[:]
+    def pruneByBudget(self, branches = 1):
+        # branches that went past maxTotalDist or maxDistOutdoors
+        self.prunedByBudget += branches
+    def pruneByBound(self, branches = 1):
+        # branches that could not beat the best path found so far
+        self.prunedByBound += branches
+    def pruneByDeadNode(self, branches = 1):
+        # branches into a node already known to be a dead end
+        self.prunedByDeadNode += branches
+    def getPrunedByBudget(self):
+        return self.prunedByBudget
+    def getPrunedByBound(self):
+        return self.prunedByBound
+    def getPrunedByDeadNode(self):
+        return self.prunedByDeadNode
+    def startTimer(self):
+        self.timerStart = time.perf_counter()
+    def stopTimer(self):
+        if self.timerStart is not None:
+            self.wallTime += time.perf_counter() - self.timerStart
+            self.timerStart = None
+    def getWallTime(self):
+        return self.wallTime
+    def getStats(self):
+        return {'nodesExpanded': self.steps, \
+            'prunedByBudget': self.prunedByBudget, \
+            'prunedByBound': self.prunedByBound, \
+            'prunedByDeadNode': self.prunedByDeadNode, \
+            'deadNodes': len(self.deadOrder), 'wallTime': self.wallTime}
     def __str__(self):
         return '[ ' + str(self.start) + ' => ' + str(self.end) + ' ]'
         
@@ -206,3 +1012,22 @@ if __name__=="__main__":
     g.addEdge(e2)
     g.addEdge(e3)
     print(g)
+
+    # Batch path evaluation (needs NumPy): a node index out of range must
+    # raise rather than alias the key of another edge
+    compact = g.toCompact()
+    try:
+        print(compact.evaluatePaths([[0, 1, 2], [0, 2]]))
+        for path in ([0, 3], [1, -1], [3, 1], [1, -3]):
+            try:
+                compact.evaluatePaths([path])
+                print(path, "KeyError not raised")
+            except KeyError as err:
+                print(path, "KeyError", err)
+    except ImportError as err:
+        print(err)
+    #~ (array([18., 14.]), array([11.,  6.]))
+    #~ [0, 3] KeyError (0, 3)
+    #~ [1, -1] KeyError (1, -1)
+    #~ [3, 1] KeyError (3, 1)
+    #~ [1, -3] KeyError (1, -3)
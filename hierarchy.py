@@ -0,0 +1,548 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# A contraction hierarchy over both distances, for fast queries on large maps
+#
+# Preprocessing removes ("contracts") the buildings one at a time, least
+# important first. When a building v is removed, every route u->v->w through
+# it that might still be worth taking is kept as a shortcut edge u->w that
+# carries the total and the outdoor distance of the route it stands for. A
+# shortcut is left out when a witness search finds another route from u to w,
+# avoiding v, that is no longer and no more outdoors: with two distances a
+# route is only replaceable by one that is at least as good in both. Between
+# two buildings the hierarchy can therefore keep several edges, one per
+# Pareto-optimal (total, outdoor) pair.
+#
+# Every route then has a counterpart, no worse in either distance, that only
+# climbs to more important buildings and then only descends. A query runs a
+# label-setting search upwards from start and one upwards (over reversed
+# edges) from end, and combines the labels that meet within both budgets.
+# Each side stops once its smallest total is no better than the best route
+# found, and the chosen route is unpacked back into original edges.
+#
+# The last, densest part of the graph is left uncontracted as a core that
+# both searches cross freely. On campus-like maps (clusters of buildings
+# joined by a few walkways) the core is tiny; on maps where every street can
+# be indoor or outdoor the core stays large and queries gain little.
+#
+# The hierarchy is saved next to its map file as mapFilename + '.ch'.
+#
+
+import heapq
+import mmap
+import os
+import struct
+from array import array
+
+from traversal import *
+
+HIERARCHY_MAGIC = b'CMPCH001'
+HIERARCHY_HEADER = struct.Struct('<8sBxxxIIIIIQQ')
+WITNESS_SETTLE_LIMIT = 250 ## labels a witness search may settle before giving up
+CORE_DEGREE = 12 ## stop contracting once the remaining buildings average this many arcs
+
+class HierarchyBuilder(object):
+    """
+    The working state of a contraction: the graph of the buildings not yet
+    contracted, and every edge and shortcut (an "arc") created so far.
+    """
+    def __init__(self, graph):
+        n = graph.numNodes()
+        self.graph = graph
+        self.arcSources = []
+        self.arcTargets = []
+        self.arcTotals = []
+        self.arcOutdoors = []
+        self.arcLeft = [] ## the first arc a shortcut stands for, -1 for an edge
+        self.arcRight = [] ## the second arc a shortcut stands for
+        self.out = [{} for i in range(n)] ## stores dest:arcs, Pareto-optimal, by total
+        self.into = [{} for i in range(n)] ## stores src:the same lists as out
+        self.contracted = bytearray(n)
+        self.removedNeighbors = [0] * n
+        self.rank = array('i', [0]) * n
+        self.upArcs = [None] * n ## arcs to more important buildings, per building
+        self.downArcs = [None] * n ## arcs from more important buildings
+        self.liveArcs = 0 ## arcs between buildings not yet contracted
+        for i in range(n):
+            for e in graph.edgeRange(i):
+                if graph.targets[e] != i:
+                    self.addArc(i, graph.targets[e], graph.totals[e], \
+                        graph.outdoors[e], -1, -1)
+    def addArc(self, src, dest, tot, outs, left, right):
+        # Adds an arc unless one already joining src to dest is at least as
+        # good in both distances, and drops those the new one beats
+        arcs = self.out[src].get(dest)
+        if arcs is None:
+            arcs = []
+            self.out[src][dest] = arcs
+            self.into[dest][src] = arcs
+        for a in arcs:
+            if self.arcTotals[a] <= tot and self.arcOutdoors[a] <= outs:
+                return False
+        self.liveArcs -= len(arcs)
+        arcs[:] = [a for a in arcs \
+            if self.arcTotals[a] < tot or self.arcOutdoors[a] < outs]
+        arcs.append(len(self.arcTotals))
+        self.liveArcs += len(arcs)
+        self.arcSources.append(src)
+        self.arcTargets.append(dest)
+        self.arcTotals.append(tot)
+        self.arcOutdoors.append(outs)
+        self.arcLeft.append(left)
+        self.arcRight.append(right)
+        arcs.sort(key=self.arcTotals.__getitem__)
+        return True
+    def witnessLabels(self, source, avoid, maxTotalDist, maxDistOutdoors):
+        """
+        Runs a small label-setting search from source over the buildings not
+        yet contracted, avoiding avoid, within both limits.
+
+        Returns:
+            A dict mapping nodes to their settled (total, outdoor) labels,
+            in increasing total order. It may be incomplete, since the
+            search stops after WITNESS_SETTLE_LIMIT labels.
+        """
+        arcTotals, arcOutdoors = self.arcTotals, self.arcOutdoors
+        queue = [(0.0, 0.0, source)]
+        settled = {}
+        minOutdoor = {}
+        pops = 0
+        while queue and pops < WITNESS_SETTLE_LIMIT:
+            tot, outs, node = heapq.heappop(queue)
+            if outs >= minOutdoor.get(node, INFINITY):
+                continue
+            pops += 1
+            minOutdoor[node] = outs
+            settled.setdefault(node, []).append((tot, outs))
+            for dest, arcs in self.out[node].items():
+                if dest == avoid:
+                    continue
+                for a in arcs:
+                    newTot = tot + arcTotals[a]
+                    newOuts = outs + arcOutdoors[a]
+                    if newTot > maxTotalDist or newOuts > maxDistOutdoors \
+                        or newOuts >= minOutdoor.get(dest, INFINITY):
+                        continue
+                    heapq.heappush(queue, (newTot, newOuts, dest))
+        return settled
+    def shortcutsFor(self, v):
+        """
+        Returns the shortcuts contracting v would need, as a list of
+        (src, dest, total, outdoor, left, right) tuples.
+        """
+        arcTotals, arcOutdoors = self.arcTotals, self.arcOutdoors
+        shortcuts = []
+        for u, inArcs in self.into[v].items():
+            candidates = []
+            for w, outArcs in self.out[v].items():
+                if w == u:
+                    continue
+                for a in inArcs:
+                    for b in outArcs:
+                        candidates.append((u, w, arcTotals[a] + arcTotals[b], \
+                            arcOutdoors[a] + arcOutdoors[b], a, b))
+            if not candidates:
+                continue
+            witnesses = self.witnessLabels(u, v, \
+                max(candidate[2] for candidate in candidates), \
+                max(candidate[3] for candidate in candidates))
+            for candidate in candidates:
+                witnessed = False
+                for tot, outs in witnesses.get(candidate[1], ()):
+                    if tot > candidate[2]:
+                        break
+                    if outs <= candidate[3]:
+                        witnessed = True
+                        break
+                if not witnessed:
+                    shortcuts.append(candidate)
+        return shortcuts
+    def priority(self, v):
+        # Contract first the buildings that add the fewest shortcuts for the
+        # arcs they take away, spreading out across the map
+        removed = 0
+        for arcs in self.out[v].values():
+            removed += len(arcs)
+        for arcs in self.into[v].values():
+            removed += len(arcs)
+        return len(self.shortcutsFor(v)) - removed + self.removedNeighbors[v]
+    def contract(self, v, rank):
+        for shortcut in self.shortcutsFor(v):
+            self.addArc(*shortcut)
+        self.rank[v] = rank
+        self.upArcs[v] = [a for arcs in self.out[v].values() for a in arcs]
+        self.downArcs[v] = [a for arcs in self.into[v].values() for a in arcs]
+        self.liveArcs -= len(self.upArcs[v]) + len(self.downArcs[v])
+        for w in self.out[v]:
+            del self.into[w][v]
+            self.removedNeighbors[w] += 1
+        for u in self.into[v]:
+            del self.out[u][v]
+            self.removedNeighbors[u] += 1
+        self.out[v] = {}
+        self.into[v] = {}
+        self.contracted[v] = 1
+    def build(self, coreDegree = CORE_DEGREE):
+        """
+        Contracts the buildings, picking the next one by priority (updated
+        lazily), and returns the finished ContractionHierarchy.
+
+        With two distances the routes worth keeping multiply as the graph
+        left over gets denser, so contraction stops once the buildings left
+        average coreDegree arcs each. Those form the core: their arcs among
+        themselves count as both upward and downward, so queries search the
+        core as an ordinary graph.
+        """
+        n = self.graph.numNodes()
+        queue = [(self.priority(v), v) for v in range(n)]
+        heapq.heapify(queue)
+        rank = 0
+        while queue and self.liveArcs <= coreDegree * len(queue):
+            oldPriority, v = heapq.heappop(queue)
+            newPriority = self.priority(v)
+            if queue and newPriority > queue[0][0]:
+                heapq.heappush(queue, (newPriority, v))
+                continue
+            self.contract(v, rank)
+            rank += 1
+        for oldPriority, v in queue:
+            self.rank[v] = rank
+            self.upArcs[v] = [a for arcs in self.out[v].values() for a in arcs]
+            self.downArcs[v] = [a for arcs in self.into[v].values() for a in arcs]
+            rank += 1
+        upOffsets, upArcs = flattenArcs(self.upArcs)
+        downOffsets, downArcs = flattenArcs(self.downArcs)
+        return ContractionHierarchy(self.graph.names, self.rank, \
+            array('i', self.arcSources), array('i', self.arcTargets), \
+            array('d', self.arcTotals), array('d', self.arcOutdoors), \
+            array('i', self.arcLeft), array('i', self.arcRight), \
+            upOffsets, upArcs, downOffsets, downArcs)
+
+def flattenArcs(arcLists):
+    # Packs one list of arcs per node into offsets and arcs arrays
+    offsets = array('q', [0])
+    arcs = array('i')
+    for nodeArcs in arcLists:
+        arcs.extend(nodeArcs)
+        offsets.append(len(arcs))
+    return offsets, arcs
+
+def buildHierarchy(digraph, coreDegree = CORE_DEGREE):
+    """
+    Preprocesses digraph into a ContractionHierarchy.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        coreDegree: how dense the graph left over may get before contraction
+            stops (see HierarchyBuilder.build)
+    """
+    return HierarchyBuilder(digraph.toCompact()).build(coreDegree)
+
+class ContractionHierarchy(object):
+    """
+    A contracted graph, ready for queries.
+
+    Arcs are the edges of the map plus the shortcuts, numbered together; a
+    shortcut records the two arcs it joins (left, then right), and an edge
+    has left -1. upArcs lists, for each node, the arcs leaving it for more
+    important nodes, at upOffsets[i]..upOffsets[i+1]-1; downArcs likewise
+    lists the arcs into each node from more important nodes.
+    """
+    def __init__(self, names, rank, arcSources, arcTargets, arcTotals, \
+        arcOutdoors, arcLeft, arcRight, upOffsets, upArcs, downOffsets, downArcs):
+        self.names = names
+        self.index = {} ## stores nodeName:index pairs
+        for i in range(len(names)):
+            self.index[names[i]] = i
+        self.rank = rank
+        self.arcSources = arcSources
+        self.arcTargets = arcTargets
+        self.arcTotals = arcTotals
+        self.arcOutdoors = arcOutdoors
+        self.arcLeft = arcLeft
+        self.arcRight = arcRight
+        self.upOffsets = upOffsets
+        self.upArcs = upArcs
+        self.downOffsets = downOffsets
+        self.downArcs = downArcs
+    def numNodes(self):
+        return len(self.names)
+    def numArcs(self):
+        return len(self.arcTotals)
+    def numShortcuts(self):
+        shortcuts = 0
+        for left in self.arcLeft:
+            if left != -1:
+                shortcuts += 1
+        return shortcuts
+    def hasNodeName(self, nodeName):
+        return nodeName in self.index
+    def save(self, hierarchyFilename, sourceStamp = (0, 0)):
+        """
+        Writes the hierarchy to a binary file that load() can memory-map.
+        sourceStamp is the (size, mtime) of the map file it was built from.
+        """
+        names = '\n'.join(self.names).encode('utf-8')
+        tempFilename = hierarchyFilename + '.tmp'
+        outFile = open(tempFilename, 'wb')
+        try:
+            outFile.write(HIERARCHY_HEADER.pack(HIERARCHY_MAGIC, \
+                CACHE_BYTE_ORDER, self.numNodes(), len(names), self.numArcs(), \
+                len(self.upArcs), len(self.downArcs), \
+                sourceStamp[0], sourceStamp[1]))
+            outFile.write(names)
+            outFile.write(bytes(-len(names) % 8))
+            # 8-byte arrays first, so that every array stays aligned
+            for values, typecode in ((self.upOffsets, 'q'), \
+                (self.downOffsets, 'q'), (self.arcTotals, 'd'), \
+                (self.arcOutdoors, 'd'), (self.rank, 'i'), \
+                (self.arcSources, 'i'), (self.arcTargets, 'i'), \
+                (self.arcLeft, 'i'), (self.arcRight, 'i'), \
+                (self.upArcs, 'i'), (self.downArcs, 'i')):
+                outFile.write(array(typecode, values).tobytes())
+        finally:
+            outFile.close()
+        os.replace(tempFilename, hierarchyFilename)
+    @classmethod
+    def load(cls, hierarchyFilename):
+        """
+        Memory-maps a file written by save().
+
+        Returns:
+            A tuple (hierarchy, sourceStamp). Raises ValueError if the file
+            is not a hierarchy.
+        """
+        inFile = open(hierarchyFilename, 'rb')
+        try:
+            buf = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            inFile.close()
+        if len(buf) < HIERARCHY_HEADER.size:
+            raise ValueError('Not a hierarchy file')
+        magic, order, n, namesSize, arcs, ups, downs, size, mtime = \
+            HIERARCHY_HEADER.unpack_from(buf, 0)
+        if magic != HIERARCHY_MAGIC or order != CACHE_BYTE_ORDER:
+            raise ValueError('Not a hierarchy file')
+        start = HIERARCHY_HEADER.size
+        if len(buf) != start + (namesSize + 7) // 8 * 8 + 16 * (n + 1) \
+            + 4 * n + 32 * arcs + 4 * (ups + downs):
+            raise ValueError('Hierarchy file has the wrong size')
+        view = memoryview(buf)
+        names = bytes(view[start:start + namesSize]).decode('utf-8')
+        names = names.split('\n') if n else []
+        start += (namesSize + 7) // 8 * 8
+        sections = []
+        for typecode, count, itemSize in (('q', n + 1, 8), ('q', n + 1, 8), \
+            ('d', arcs, 8), ('d', arcs, 8), ('i', n, 4), ('i', arcs, 4), \
+            ('i', arcs, 4), ('i', arcs, 4), ('i', arcs, 4), ('i', ups, 4), \
+            ('i', downs, 4)):
+            sections.append(view[start:start + count * itemSize].cast(typecode))
+            start += count * itemSize
+        upOffsets, downOffsets, arcTotals, arcOutdoors, rank, arcSources, \
+            arcTargets, arcLeft, arcRight, upArcs, downArcs = sections
+        hierarchy = cls(names, rank, arcSources, arcTargets, arcTotals, \
+            arcOutdoors, arcLeft, arcRight, upOffsets, upArcs, downOffsets, \
+            downArcs)
+        hierarchy.buffer = buf
+        return hierarchy, (size, mtime)
+    def unpack(self, arc, path):
+        # Appends the nodes after the first one on the route arc stands for
+        pending = [arc]
+        while pending:
+            arc = pending.pop()
+            if self.arcLeft[arc] == -1:
+                path.append(self.names[self.arcTargets[arc]])
+            else:
+                pending.append(self.arcRight[arc])
+                pending.append(self.arcLeft[arc])
+    def search(self, start, end, maxTotalDist, maxDistOutdoors):
+        """
+        Finds the shortest path from start to end with both distances within
+        their limits, by searching upwards from both ends.
+
+        Returns:
+            The path, as a list of building numbers (strings). Raises
+            ValueError if there is none.
+        """
+        if start == end:
+            return [start]
+        arcTotals, arcOutdoors = self.arcTotals, self.arcOutdoors
+        # Forward labels follow arcs to their targets; backward ones follow
+        # arcs into a node back to their sources
+        sides = ((self.upOffsets, self.upArcs, self.arcTargets), \
+            (self.downOffsets, self.downArcs, self.arcSources))
+        ## labels are (total, outdoor, node, parent label, arc taken)
+        labels = ([(0.0, 0.0, self.index[start], -1, -1)], \
+            [(0.0, 0.0, self.index[end], -1, -1)])
+        queues = ([(0.0, 0.0, 0)], [(0.0, 0.0, 0)])
+        settled = ({}, {})
+        minOutdoor = ({}, {})
+        bestTotal = INFINITY
+        best = None
+        while queues[0] or queues[1]:
+            if not queues[1] or (queues[0] and queues[0][0][0] <= queues[1][0][0]):
+                side = 0
+            else:
+                side = 1
+            if queues[side][0][0] >= bestTotal:
+                break
+            other = 1 - side
+            tot, outs, label = heapq.heappop(queues[side])
+            node = labels[side][label][2]
+            if outs >= minOutdoor[side].get(node, INFINITY):
+                continue
+            minOutdoor[side][node] = outs
+            settled[side].setdefault(node, []).append(label)
+            for meet in settled[other].get(node, ()):
+                meetTot, meetOuts = labels[other][meet][:2]
+                if outs + meetOuts <= maxDistOutdoors and \
+                    tot + meetTot <= maxTotalDist and tot + meetTot < bestTotal:
+                    bestTotal = tot + meetTot
+                    best = (label, meet) if side == 0 else (meet, label)
+            offsets, arcs, ends = sides[side]
+            for i in range(offsets[node], offsets[node + 1]):
+                arc = arcs[i]
+                newTot = tot + arcTotals[arc]
+                newOuts = outs + arcOutdoors[arc]
+                dest = ends[arc]
+                if newTot > maxTotalDist or newOuts > maxDistOutdoors \
+                    or newTot >= bestTotal \
+                    or newOuts >= minOutdoor[side].get(dest, INFINITY):
+                    continue
+                labels[side].append((newTot, newOuts, dest, label, arc))
+                heapq.heappush(queues[side], \
+                    (newTot, newOuts, len(labels[side]) - 1))
+        if best is None:
+            raise ValueError("No path satisfies the constraints")
+        # Arcs from start up to the meeting node, then down to end
+        route = []
+        label = best[0]
+        while labels[0][label][3] != -1:
+            route.append(labels[0][label][4])
+            label = labels[0][label][3]
+        route.reverse()
+        label = best[1]
+        while labels[1][label][3] != -1:
+            route.append(labels[1][label][4])
+            label = labels[1][label][3]
+        walk = [start]
+        for arc in route:
+            self.unpack(arc, walk)
+        # With zero-length edges the two halves can overlap, so the walk may
+        # come back to a node. Such a cycle adds no total distance (or the
+        # route without it would have been shorter) and no less outdoor
+        # distance, so cutting it out keeps both budgets.
+        path = []
+        position = {} ## stores node:its index in path
+        for node in walk:
+            if node in position:
+                for dropped in path[position[node] + 1:]:
+                    del position[dropped]
+                del path[position[node] + 1:]
+            else:
+                position[node] = len(path)
+                path.append(node)
+        return path
+
+def load_hierarchy(mapFilename, digraph = None):
+    """
+    Opens the contraction hierarchy stored next to a map file as
+    mapFilename + '.ch', building it first if it is missing or was built
+    from a different version of the map file.
+
+    Parameters:
+        mapFilename: name of the map file
+        digraph: the graph loaded from mapFilename, if already at hand. It
+            is only used to build the hierarchy if it has not changed since
+            it was loaded.
+
+    Returns:
+        a ContractionHierarchy
+    """
+    mapFile = findMapFile(mapFilename)
+    info = os.stat(mapFile)
+    stamp = (info.st_size, info.st_mtime_ns)
+    hierarchyFilename = mapFile + '.ch'
+    try:
+        hierarchy, builtFrom = ContractionHierarchy.load(hierarchyFilename)
+        if builtFrom == stamp:
+            return hierarchy
+    except (OSError, ValueError):
+        pass
+    if digraph is None or digraph.getVersion() != 0:
+        digraph = load_compact_map(mapFile)
+    hierarchy = buildHierarchy(digraph)
+    try:
+        hierarchy.save(hierarchyFilename, stamp)
+    except OSError:
+        pass ## a read-only map directory just means building it every time
+    return hierarchy
+
+def hierarchySearch(digraph, hierarchy, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the shortest path from start to end like labelSettingSearch,
+    using hierarchy while it still describes digraph. The hierarchy is built
+    from the map file, so once digraph has been changed since it was loaded,
+    or for a building the hierarchy does not know, the query falls back to
+    labelSettingSearch.
+
+    Returns:
+        The shortest path satisfying both constraints, as a list of
+        building numbers (strings). Raises ValueError if there is none.
+    """
+    if digraph.changesSince(0) or not hierarchy.hasNodeName(start) or \
+        not hierarchy.hasNodeName(end):
+        return labelSettingSearch(digraph, start, end, maxTotalDist, \
+            maxDistOutdoors)
+    return hierarchy.search(start, end, maxTotalDist, maxDistOutdoors)
+
+if __name__ == '__main__':
+    ## Test cases: the hierarchy must agree with bruteForceSearch on every
+    ## query of the small maps (same total, or both raising ValueError)
+    LARGE_DIST = 1000000
+    budgets = [(LARGE_DIST, LARGE_DIST), (18, 18), (18, 0), (15, 15), \
+        (10, 10), (35, 8), (21, 1), (8, 2), (1, 1), (0, 0)]
+    for mapFilename in ("map2.txt", "map3.txt", "map5.txt", "map6.txt", \
+        "map7.txt", "map8.txt"):
+        digraph = load_map(mapFilename)
+        hierarchy = buildHierarchy(digraph)
+        names = [str(node) for node in digraph.nodes]
+        mismatches = 0
+        for start in names:
+            for end in names:
+                for maxTotalDist, maxDistOutdoors in budgets:
+                    try:
+                        expected = digraph.getTotalDistance(bruteForceSearch(\
+                            digraph, start, end, maxTotalDist, maxDistOutdoors))
+                    except ValueError:
+                        expected = None
+                    try:
+                        path = hierarchy.search(start, end, maxTotalDist, \
+                            maxDistOutdoors)
+                        found = digraph.getTotalDistance(path)
+                        if len(set(path)) != len(path) or \
+                            digraph.getOutdoorDistance(path) > maxDistOutdoors:
+                            found = 'invalid'
+                    except ValueError:
+                        found = None
+                    if found != expected:
+                        mismatches += 1
+        print(mapFilename, mismatches)
+    #~ map2.txt 0
+    #~ map3.txt 0
+    #~ map5.txt 0
+    #~ map6.txt 0
+    #~ map7.txt 0
+    #~ map8.txt 0
+
+    # Zero-length edges: the two halves of the route overlap
+    map8 = load_map("map8.txt")
+    print(buildHierarchy(map8).search("4", "0", LARGE_DIST, LARGE_DIST))
+    #~ ['4', '1', '0']
+
+    # A building added after the hierarchy was built is searched for instead
+    hierarchy = buildHierarchy(map8)
+    map8.addNode(Node("9"))
+    map8.addEdge(WeightedEdge(map8.getNode("4"), map8.getNode("9"), 2, 1))
+    print(hierarchySearch(map8, hierarchy, "4", "9", LARGE_DIST, LARGE_DIST))
+    #~ ['4', '9']
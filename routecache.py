@@ -0,0 +1,210 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# A bounded cache of route query results
+#
+# Results are kept per (start, end, maxTotalDist, maxDistOutdoors) query and
+# evicted least-recently-used first once their estimated size passes a byte
+# limit. A query can also be answered from a result cached under different
+# budgets:
+#
+#  - If a route was the best one under looser budgets (both limits at least
+#    as large) and it also fits the tighter ones, it is still the best: every
+#    route allowed by the tighter budgets was allowed by the looser ones.
+#  - If that best route is over the tighter total limit, nothing fits them.
+#  - If no route fitted some budgets, none fits any tighter budgets either.
+#
+# The cache follows changes to the graph it serves. Removing an edge or
+# making it longer only drops the cached routes through that edge: every
+# other cached route is still the best, since no route got any better, and
+# a query with no route still has none. Adding an edge or making one shorter
+# can improve any route, so that clears the whole cache.
+#
+
+import sys
+from collections import OrderedDict
+
+from traversal import *
+
+DEFAULT_CACHE_BYTES = 16 << 20
+ENTRY_OVERHEAD = 200 ## rough bytes per entry for the key, record and links
+
+class CachedRoute(object):
+    """
+    One cached query result: the best path under budgets (maxTotal,
+    maxOutdoors) with its distances, or path None if there was no path.
+    """
+    __slots__ = ('maxTotal', 'maxOutdoors', 'path', 'total', 'outdoor', 'size')
+    def __init__(self, maxTotal, maxOutdoors, path, total, outdoor):
+        self.maxTotal = maxTotal
+        self.maxOutdoors = maxOutdoors
+        self.path = path
+        self.total = total
+        self.outdoor = outdoor
+        self.size = ENTRY_OVERHEAD
+        if path is not None:
+            self.size += sys.getsizeof(path)
+    def covers(self, maxTotalDist, maxDistOutdoors):
+        # Whether this result also answers a query with these budgets
+        if maxTotalDist > self.maxTotal or maxDistOutdoors > self.maxOutdoors:
+            return False
+        return self.path is None or self.total > maxTotalDist or \
+            self.outdoor <= maxDistOutdoors
+    def narrowedTo(self, maxTotalDist, maxDistOutdoors):
+        # The answer for tighter budgets this result covers. The cached path
+        # has the least total under the looser budgets, so if even that is
+        # over maxTotalDist, nothing fits
+        if self.path is not None and self.total > maxTotalDist:
+            return CachedRoute(maxTotalDist, maxDistOutdoors, None, \
+                INFINITY, INFINITY)
+        return self
+
+class RouteCache(object):
+    """
+    An LRU cache in front of a search function, bounded by the estimated
+    memory its entries take rather than by their number.
+    """
+    def __init__(self, maxBytes = DEFAULT_CACHE_BYTES):
+        self.maxBytes = maxBytes
+        self.bytesUsed = 0
+        self.entries = OrderedDict() ## stores query:CachedRoute, oldest first
+        self.byPair = {} ## stores (start, end):set of cached queries
+        self.byEdge = {} ## stores (src, dest):set of cached queries using that edge
+        self.graph = None ## the graph the entries were computed on
+        self.version = 0 ## the version of graph they are up to date with
+        self.hits = 0
+        self.budgetHits = 0
+        self.misses = 0
+        self.invalidated = 0
+    def lookup(self, start, end, maxTotalDist, maxDistOutdoors):
+        """
+        Returns the CachedRoute answering the query, or None on a miss.
+        """
+        key = (start, end, maxTotalDist, maxDistOutdoors)
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+        for other in self.byPair.get((start, end), ()):
+            entry = self.entries[other]
+            if entry.covers(maxTotalDist, maxDistOutdoors):
+                self.entries.move_to_end(other)
+                self.budgetHits += 1
+                return entry.narrowedTo(maxTotalDist, maxDistOutdoors)
+        self.misses += 1
+        return None
+    def store(self, start, end, maxTotalDist, maxDistOutdoors, entry):
+        key = (start, end, maxTotalDist, maxDistOutdoors)
+        if key in self.entries:
+            self.discard(key)
+        if entry.size > self.maxBytes:
+            return
+        self.entries[key] = entry
+        self.byPair.setdefault((start, end), set()).add(key)
+        if entry.path is not None:
+            for i in range(len(entry.path) - 1):
+                self.byEdge.setdefault((entry.path[i], entry.path[i+1]), \
+                    set()).add(key)
+        self.bytesUsed += entry.size
+        while self.bytesUsed > self.maxBytes:
+            self.discard(next(iter(self.entries)))
+    def discard(self, key):
+        entry = self.entries.pop(key)
+        self.bytesUsed -= entry.size
+        pair = self.byPair[key[:2]]
+        pair.discard(key)
+        if not pair:
+            del self.byPair[key[:2]]
+        if entry.path is not None:
+            for i in range(len(entry.path) - 1):
+                edge = (entry.path[i], entry.path[i+1])
+                users = self.byEdge.get(edge)
+                if users is not None:
+                    users.discard(key)
+                    if not users:
+                        del self.byEdge[edge]
+    def sync(self, digraph):
+        """
+        Brings the cache up to date with digraph, dropping the entries that
+        the changes made to it since the last sync may have made wrong. A
+        cache serves one graph at a time, so it is cleared if digraph is not
+        the graph it was last synced with.
+        """
+        if digraph is not self.graph:
+            self.clear()
+            self.graph = digraph
+            self.version = digraph.getVersion()
+            return
+        changes = digraph.changesSince(self.version)
+        self.version = digraph.getVersion()
+        for version, kind, srcName, destName in changes:
+            if kind == 'better':
+                self.invalidated += len(self.entries)
+                self.clear()
+                return
+            if kind == 'nodeAdded':
+                # A node without edges yet changes no route
+                continue
+            if kind == 'worse':
+                stale = self.byEdge.get((srcName, destName), ())
+            else:
+                # Routes through a removed node used one of its edges, which
+                # were logged first; only the route from it to itself is left
+                stale = self.byPair.get((srcName, srcName), ())
+            for key in list(stale):
+                self.discard(key)
+                self.invalidated += 1
+    def search(self, digraph, start, end, maxTotalDist, maxDistOutdoors, \
+        routeFn = labelSettingRoute):
+        """
+        Finds the shortest path from start to end like routeFn, answering
+        from the cache when it can.
+
+        Parameters:
+            digraph: instance of class WeightedDigraph or CompactDigraph
+            start, end: start & end building numbers (strings)
+            maxTotalDist : maximum total distance on a path
+            maxDistOutdoors: maximum distance spent outdoors on a path
+            routeFn: the search to run on a miss, called as
+                routeFn(digraph, start, end, maxTotalDist, maxDistOutdoors)
+                and returning (path, total, outdoor) like labelSettingRoute
+
+        The cache is synced with digraph first, so changes made to the graph
+        since the last search are taken into account.
+
+        Returns:
+            The shortest path satisfying both constraints, as a list of
+            building numbers (strings). Raises ValueError if there is none.
+        """
+        self.sync(digraph)
+        entry = self.lookup(start, end, maxTotalDist, maxDistOutdoors)
+        if entry is None:
+            try:
+                path, total, outdoor = routeFn(digraph, start, end, \
+                    maxTotalDist, maxDistOutdoors)
+                entry = CachedRoute(maxTotalDist, maxDistOutdoors, path, \
+                    total, outdoor)
+            except ValueError:
+                entry = CachedRoute(maxTotalDist, maxDistOutdoors, None, \
+                    INFINITY, INFINITY)
+            self.store(start, end, maxTotalDist, maxDistOutdoors, entry)
+        if entry.path is None:
+            raise ValueError("No path satisfies the constraints")
+        return entry.path[:]
+    def clear(self):
+        self.entries.clear()
+        self.byPair.clear()
+        self.byEdge.clear()
+        self.bytesUsed = 0
+    def getStats(self):
+        """
+        Returns a dict of hits (exact), budgetHits (answered from another
+        budget), misses, invalidated (entries dropped after graph changes),
+        entries and bytesUsed.
+        """
+        return {'hits': self.hits, 'budgetHits': self.budgetHits, \
+            'misses': self.misses, 'invalidated': self.invalidated, \
+            'entries': len(self.entries), 'bytesUsed': self.bytesUsed}
+    def __len__(self):
+        return len(self.entries)
@@ -0,0 +1,271 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# An all-pairs distance index for answering unconstrained queries without
+# searching
+#
+# For every ordered pair of buildings the index stores the shortest total
+# distance, the outdoor distance along that route, and the first hop of the
+# route. Ties on total distance are broken towards less outdoor distance, so
+# the stored route is also the one with the least outdoor walking among all
+# shortest routes. The tables take 20 bytes per pair, which is meant for
+# campus-sized maps (a few thousand buildings), not for 10^5 nodes.
+#
+# The index describes its map file, which a graph fresh from load_map matches
+# at version 0. Once the graph changes the index is not rebuilt; instead it
+# stops trusting the stored routes that use a removed or lengthened edge, and
+# all of them once an edge is added or shortened, and those queries fall
+# back to searching.
+#
+
+import heapq
+import mmap
+import os
+import struct
+from array import array
+
+from traversal import *
+
+INDEX_MAGIC = b'CMPIDX01'
+INDEX_HEADER = struct.Struct('<8sBxxxIQQQ')
+
+def shortestPathTree(graph, source):
+    """
+    Runs Dijkstra's algorithm on a CompactDigraph out of source (an index),
+    ordering routes by (total, outdoor).
+
+    Returns:
+        A tuple (totals, outdoors, firstHops) of arrays indexed by node:
+        the distances of the best route from source, and the node that route
+        visits right after source (-1 if unreachable, source for itself).
+    """
+    n = graph.numNodes()
+    offsets, targets = graph.offsets, graph.targets
+    edgeTotals, edgeOutdoors = graph.totals, graph.outdoors
+    totals = array('d', [INFINITY]) * n
+    outdoors = array('d', [INFINITY]) * n
+    firstHops = array('i', [-1]) * n
+    done = bytearray(n)
+    totals[source] = 0.0
+    outdoors[source] = 0.0
+    firstHops[source] = source
+    queue = [(0.0, 0.0, source)]
+    while queue:
+        tot, outs, node = heapq.heappop(queue)
+        if done[node]:
+            continue
+        done[node] = 1
+        for e in range(offsets[node], offsets[node + 1]):
+            dest = targets[e]
+            newTot = tot + edgeTotals[e]
+            newOuts = outs + edgeOutdoors[e]
+            if done[dest] or newTot > totals[dest] or \
+                (newTot == totals[dest] and newOuts >= outdoors[dest]):
+                continue
+            totals[dest] = newTot
+            outdoors[dest] = newOuts
+            firstHops[dest] = dest if node == source else firstHops[node]
+            heapq.heappush(queue, (newTot, newOuts, dest))
+    return totals, outdoors, firstHops
+
+def buildDistanceIndex(digraph, indexFilename, sourceStamp = (0, 0)):
+    """
+    Precomputes the all-pairs tables of digraph and writes them to
+    indexFilename, one Dijkstra search per building. Rows are written as
+    they are computed, so only one row is held in memory at a time.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        indexFilename: where to write the index
+        sourceStamp: (size, mtime) of the map file the graph came from
+    """
+    graph = digraph.toCompact()
+    n = graph.numNodes()
+    names = '\n'.join(graph.names).encode('utf-8')
+    tempFilename = indexFilename + '.tmp'
+    outFile = open(tempFilename, 'wb')
+    try:
+        outFile.write(INDEX_HEADER.pack(INDEX_MAGIC, CACHE_BYTE_ORDER, n, \
+            len(names), sourceStamp[0], sourceStamp[1]))
+        outFile.write(names)
+        outFile.write(bytes(-len(names) % 8))
+        # Three tables of n rows each follow: totals, outdoors, first hops
+        base = outFile.tell()
+        rowSizes = (8 * n, 8 * n, 4 * n)
+        tableStarts = (base, base + 8 * n * n, base + 16 * n * n)
+        outFile.truncate(base + 20 * n * n)
+        for source in range(n):
+            rows = shortestPathTree(graph, source)
+            for table in range(3):
+                outFile.seek(tableStarts[table] + source * rowSizes[table])
+                outFile.write(rows[table].tobytes())
+    finally:
+        outFile.close()
+    os.replace(tempFilename, indexFilename)
+
+class DistanceIndex(object):
+    """
+    A memory-mapped all-pairs index written by buildDistanceIndex.
+    """
+    def __init__(self, indexFilename):
+        inFile = open(indexFilename, 'rb')
+        try:
+            self.buffer = mmap.mmap(inFile.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            inFile.close()
+        if len(self.buffer) < INDEX_HEADER.size:
+            raise ValueError('Not a distance index file')
+        magic, order, n, namesSize, size, mtime = \
+            INDEX_HEADER.unpack_from(self.buffer, 0)
+        if magic != INDEX_MAGIC or order != CACHE_BYTE_ORDER:
+            raise ValueError('Not a distance index file')
+        start = INDEX_HEADER.size
+        if len(self.buffer) != start + (namesSize + 7) // 8 * 8 + 20 * n * n:
+            raise ValueError('Distance index file has the wrong size')
+        self.sourceStamp = (size, mtime)
+        view = memoryview(self.buffer)
+        names = bytes(view[start:start + namesSize]).decode('utf-8')
+        self.names = names.split('\n') if n else []
+        self.index = {}
+        for i in range(n):
+            self.index[self.names[i]] = i
+        start += (namesSize + 7) // 8 * 8
+        self.totals = view[start:start + 8 * n * n].cast('d')
+        start += 8 * n * n
+        self.outdoors = view[start:start + 8 * n * n].cast('d')
+        start += 8 * n * n
+        self.firstHops = view[start:start + 4 * n * n].cast('i')
+        self.graph = None ## the graph the index is kept in sync with
+        self.version = 0 ## the version of graph the index is up to date with
+        self.staleEdges = set() ## stores (src, dest) of removed or longer edges
+        self.staleNodes = set() ## stores names of removed nodes
+        self.allStale = False ## whether an edge was added or made shorter
+    def sync(self, digraph):
+        """
+        Catches up with the changes made to digraph, a graph loaded from the
+        same map file, since the last sync.
+        """
+        if digraph is not self.graph:
+            self.graph = digraph
+            self.version = 0
+            self.staleEdges = set()
+            self.staleNodes = set()
+            self.allStale = False
+        for version, kind, srcName, destName in digraph.changesSince(self.version):
+            if kind == 'better':
+                self.allStale = True
+            elif kind == 'worse':
+                self.staleEdges.add((srcName, destName))
+            elif kind == 'nodeRemoved':
+                self.staleNodes.add(srcName)
+        self.version = digraph.getVersion()
+    def isStale(self, path):
+        # Whether the graph changed along path since the index was built
+        if self.allStale or path[0] in self.staleNodes:
+            return True
+        for i in range(len(path) - 1):
+            if (path[i], path[i+1]) in self.staleEdges:
+                return True
+        return False
+    def numNodes(self):
+        return len(self.names)
+    def getSourceStamp(self):
+        return self.sourceStamp
+    def getDistances(self, start, end):
+        """
+        Returns the (total, outdoor) distance of the shortest route from
+        start to end, or (inf, inf) if end cannot be reached.
+        """
+        pair = self.index[start] * len(self.names) + self.index[end]
+        return self.totals[pair], self.outdoors[pair]
+    def getPath(self, start, end):
+        """
+        Returns the shortest route from start to end as a list of building
+        numbers, by following first hops, or None if there is none.
+        """
+        n = len(self.names)
+        node = self.index[start]
+        target = self.index[end]
+        if self.firstHops[node * n + target] == -1:
+            return None
+        path = [self.names[node]]
+        while node != target:
+            node = self.firstHops[node * n + target]
+            path.append(self.names[node])
+        return path
+    def search(self, start, end, maxTotalDist, maxDistOutdoors):
+        """
+        Answers a query from the tables when that is possible.
+
+        The stored route has the least total distance, and the least outdoor
+        distance among those, so if it fits both budgets it is the answer;
+        and if its total is over maxTotalDist no route can fit. Removing or
+        lengthening edges since then never made a route shorter, so the
+        second rule holds until an edge is added or shortened.
+
+        Returns:
+            The path, or None when the outdoor budget rules out the stored
+            route, the graph changed along it, or start or end was added to
+            the graph after the index was built, and a search is needed.
+            Raises ValueError when no path satisfies the constraints.
+        """
+        if self.allStale or start not in self.index or end not in self.index:
+            return None
+        tot, outs = self.getDistances(start, end)
+        if tot == INFINITY or tot > maxTotalDist:
+            raise ValueError("No path satisfies the constraints")
+        if outs > maxDistOutdoors:
+            return None
+        path = self.getPath(start, end)
+        if self.isStale(path):
+            return None
+        return path
+
+def load_distance_index(mapFilename, digraph = None):
+    """
+    Opens the distance index stored next to a map file as
+    mapFilename + '.index', building it first if it is missing or was built
+    from a different version of the map file.
+
+    Parameters:
+        mapFilename: name of the map file
+        digraph: the graph loaded from mapFilename, if already at hand. It
+            is only used to build the index if it has not changed since it
+            was loaded.
+
+    Returns:
+        a DistanceIndex
+    """
+    mapFile = findMapFile(mapFilename)
+    info = os.stat(mapFile)
+    stamp = (info.st_size, info.st_mtime_ns)
+    indexFilename = mapFile + '.index'
+    try:
+        index = DistanceIndex(indexFilename)
+        if index.getSourceStamp() == stamp:
+            return index
+    except (OSError, ValueError):
+        pass
+    if digraph is None or digraph.getVersion() != 0:
+        digraph = load_compact_map(mapFile)
+    buildDistanceIndex(digraph, indexFilename, stamp)
+    return DistanceIndex(indexFilename)
+
+def indexedSearch(digraph, index, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the shortest path from start to end like labelSettingSearch, but
+    answers from index whenever the stored shortest route already fits the
+    outdoor budget, which takes time proportional to the path length.
+    index is synced with digraph first, so changes made to the graph since
+    it was loaded are taken into account.
+
+    Returns:
+        The shortest path satisfying both constraints, as a list of
+        building numbers (strings). Raises ValueError if there is none.
+    """
+    index.sync(digraph)
+    path = index.search(start, end, maxTotalDist, maxDistOutdoors)
+    if path is None:
+        return labelSettingSearch(digraph, start, end, maxTotalDist, \
+            maxDistOutdoors)
+    return path
@@ -0,0 +1,243 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# A long-running HTTP/JSON routing service
+#
+# Usage:
+#   python service.py --map mit_map.txt --port 8080
+#   curl 'http://localhost:8080/route?start=1&end=32&maxTotal=1000&maxOutdoor=0'
+#   curl 'http://localhost:8080/stats'
+#
+# The map is loaded once. Searches run in an executor (threads by default,
+# or worker processes with --processes) so the event loop keeps accepting
+# requests while they run, and requests for a query that is already being
+# searched wait for that search instead of starting another one. At most
+# maxPending distinct searches run or wait at a time; past that the service
+# answers 503 straight away rather than letting a queue build up.
+#
+# Only the standard library is used; each connection carries one request.
+#
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import json
+import multiprocessing
+import sys
+import time
+import traceback
+from urllib.parse import parse_qs, urlsplit
+
+from traversal import *
+
+DEFAULT_MAX_PENDING = 64
+LATENCY_WINDOW = 1024 ## how many recent requests the latency figures cover
+MAX_HEADER_BYTES = 16384
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', \
+    405: 'Method Not Allowed', 500: 'Internal Server Error', \
+    503: 'Service Unavailable', 504: 'Gateway Timeout'}
+
+class ServiceBusyError(RuntimeError):
+    """
+    Raised when a query would start a search past the pending limit.
+    """
+
+class RouteService(object):
+    """
+    Answers route queries over one graph for an asyncio HTTP server.
+    """
+    def __init__(self, digraph, maxPending = DEFAULT_MAX_PENDING, \
+        processes = None, timeout = None):
+        self.graph = digraph.toCompact()
+        self.timeout = timeout
+        if processes:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            self.executor = concurrent.futures.ProcessPoolExecutor(processes, \
+                context, initSearchWorker, (self.graph,))
+            # Start the workers now: forking later, once the event loop has
+            # started threads of its own (to resolve addresses, say), can
+            # leave a worker stuck on a lock one of those threads held
+            self.executor.submit(len, ()).result()
+        else:
+            # Threads share the process, so they are handed this service's
+            # graph with each search rather than through the worker global
+            self.executor = concurrent.futures.ThreadPoolExecutor()
+        self.processes = processes
+        self.maxPending = maxPending
+        self.inFlight = {} ## stores query:future of the search answering it
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.requests = 0
+        self.searches = 0
+        self.shared = 0
+        self.rejected = 0
+    async def route(self, start, end, maxTotalDist, maxDistOutdoors):
+        """
+        Finds the shortest path from start to end within both constraints,
+        sharing the search with any identical query already in flight.
+
+        Returns:
+            A QueryResult. Raises ServiceBusyError if maxPending searches
+            are already running or waiting.
+        """
+        query = (start, end, float(maxTotalDist), float(maxDistOutdoors))
+        future = self.inFlight.get(query)
+        if future is not None:
+            self.shared += 1
+            return await asyncio.shield(future)
+        results, groups = groupQueries(self.graph, [query])
+        if results[0] is not None:
+            return results[0]
+        if len(self.inFlight) >= self.maxPending:
+            self.rejected += 1
+            raise ServiceBusyError("Too many searches pending")
+        future = asyncio.ensure_future(self.search(groups[0]))
+        self.inFlight[query] = future
+        future.add_done_callback(lambda done: self.inFlight.pop(query, None))
+        return await asyncio.shield(future)
+    async def search(self, group):
+        self.searches += 1
+        loop = asyncio.get_running_loop()
+        if self.processes:
+            answers = await loop.run_in_executor(self.executor, \
+                runSearchTask, (group, self.timeout))
+        else:
+            answers = await loop.run_in_executor(self.executor, \
+                self.searchGroup, group)
+        return answers[0][1]
+    def searchGroup(self, group):
+        # Runs in an executor thread: answers one group on this service's graph
+        deadline = None if self.timeout is None \
+            else time.monotonic() + self.timeout
+        return answerGroup(self.graph, group, deadline)
+    async def respond(self, method, target):
+        # Returns (status, body dict) for one request
+        if method != 'GET':
+            return 405, {'error': 'Only GET is supported'}
+        parts = urlsplit(target)
+        if parts.path == '/stats':
+            return 200, self.getStats()
+        if parts.path == '/health':
+            return 200, {'nodes': self.graph.numNodes(), \
+                'edges': self.graph.numEdges()}
+        if parts.path != '/route':
+            return 404, {'error': 'Unknown path {0}'.format(parts.path)}
+        params = parse_qs(parts.query)
+        try:
+            start = params['start'][0]
+            end = params['end'][0]
+            maxTotalDist = float(params.get('maxTotal', [INFINITY])[0])
+            maxDistOutdoors = float(params.get('maxOutdoor', [INFINITY])[0])
+        except (KeyError, ValueError):
+            return 400, {'error': 'Expected start, end and optionally ' \
+                'maxTotal and maxOutdoor'}
+        try:
+            result = await self.route(start, end, maxTotalDist, maxDistOutdoors)
+        except ServiceBusyError as err:
+            return 503, {'error': str(err)}
+        error = result.getError()
+        if isinstance(error, TimeoutError):
+            return 504, {'error': str(error)}
+        if error is not None:
+            status = 404 if self.graph.hasNodeName(start) and \
+                self.graph.hasNodeName(end) else 400
+            return status, {'error': str(error)}
+        return 200, {'path': result.getPath(), 'total': result.getTotal(), \
+            'outdoor': result.getOutdoor()}
+    async def handle(self, reader, writer):
+        # Serves one HTTP request on a new connection
+        began = time.perf_counter()
+        try:
+            try:
+                head = await reader.readuntil(b'\r\n\r\n')
+                if len(head) > MAX_HEADER_BYTES:
+                    raise ValueError('Request too large')
+                method, target, version = \
+                    head.split(b'\r\n', 1)[0].decode('latin-1').split(' ')
+            except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, \
+                ValueError):
+                status, body = 400, {'error': 'Malformed request'}
+            else:
+                try:
+                    status, body = await self.respond(method, target)
+                except Exception as err:
+                    # Answer rather than drop the connection, and leave the
+                    # details for whoever runs the service
+                    traceback.print_exc()
+                    status, body = 500, {'error': 'Internal error: {0}' \
+                        .format(err)}
+            latency = 1000 * (time.perf_counter() - began)
+            self.requests += 1
+            self.latencies.append(latency)
+            body['latencyMs'] = round(latency, 3)
+            data = json.dumps(body).encode('utf-8')
+            header = 'HTTP/1.1 {0} {1}\r\nContent-Type: application/json\r\n' \
+                'Content-Length: {2}\r\nX-Response-Time-Ms: {3:.3f}\r\n' \
+                .format(status, REASONS[status], len(data), latency)
+            if status == 503:
+                header += 'Retry-After: 1\r\n'
+            writer.write((header + 'Connection: close\r\n\r\n').encode('latin-1') \
+                + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+    def getStats(self):
+        """
+        Returns a dict of request and search counts, and the median, 95th
+        percentile and maximum latency in milliseconds over the most recent
+        requests.
+        """
+        recent = sorted(self.latencies)
+        stats = {'requests': self.requests, 'searches': self.searches, \
+            'shared': self.shared, 'rejected': self.rejected, \
+            'pending': len(self.inFlight)}
+        if recent:
+            stats['recentLatencyMs'] = {'p50': recent[len(recent) // 2], \
+                'p95': recent[min(len(recent) - 1, len(recent) * 95 // 100)], \
+                'max': recent[-1]}
+        return stats
+    async def serve(self, host = 'localhost', port = 8080):
+        """
+        Starts listening, and returns the asyncio server.
+        """
+        return await asyncio.start_server(self.handle, host, port)
+    def close(self):
+        self.executor.shutdown(wait=False)
+
+async def runService(service, host, port):
+    server = await service.serve(host, port)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print('Serving routes on', addresses, file=sys.stderr)
+    async with server:
+        await server.serve_forever()
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description='Serve campus routes over HTTP')
+    parser.add_argument('--map', default='mit_map.txt')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-pending', type=int, default=DEFAULT_MAX_PENDING, \
+        help='distinct searches allowed to run or wait before answering 503')
+    parser.add_argument('--processes', type=int, default=0, \
+        help='search in this many worker processes instead of threads')
+    parser.add_argument('--timeout', type=float, \
+        help='give up on a search after this many seconds')
+    args = parser.parse_args(argv)
+
+    service = RouteService(load_compact_map(args.map), args.max_pending, \
+        args.processes, args.timeout)
+    try:
+        asyncio.run(runService(service, args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
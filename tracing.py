@@ -0,0 +1,124 @@
+# 6.00.2x Problem Set 5
+# Graph optimization
+#
+# Tracers for watching what the searches do
+#
+# Searches report events (a node expanded, a dead end found, a path found)
+# to a tracer instead of printing them. The default tracer does nothing, and
+# searches check its enabled flag before building an event, so an untraced
+# search pays one attribute lookup per step. They then ask wants(kind), and
+# only build and send the event if the answer is yes, so a SampledTracer
+# decides what to keep before any event is built. The recording tracers keep
+# events, either in memory or in a JSON Lines file, and a SampledTracer in
+# front of one passes it only a sample of them.
+#
+
+import collections
+import json
+import random
+import time
+
+class Tracer(object):
+    """
+    The tracer interface, and the default tracer: it ignores every event.
+    """
+    enabled = False
+    def wants(self, kind):
+        # Whether the next event of this kind should be built and sent
+        return self.enabled
+    def event(self, kind, **fields):
+        pass
+    def close(self):
+        pass
+
+class SampledTracer(Tracer):
+    """
+    Passes a sample of the events it is told about on to another tracer:
+    every Nth event, and of those each one with probability sampleRate.
+    The choice is made in wants(), so events left out are never built, and
+    event() passes on every event it is sent.
+    """
+    def __init__(self, tracer, every = 1, sampleRate = 1.0, seed = None):
+        self.tracer = tracer
+        self.enabled = tracer.enabled
+        self.every = every
+        self.sampleRate = sampleRate
+        self.random = random.Random(seed)
+        self.seen = 0
+        self.forwarded = 0
+    def wants(self, kind):
+        self.seen += 1
+        if self.seen % self.every != 0:
+            return False
+        if self.sampleRate < 1.0 and self.random.random() >= self.sampleRate:
+            return False
+        return self.tracer.wants(kind)
+    def event(self, kind, **fields):
+        self.forwarded += 1
+        self.tracer.event(kind, **fields)
+    def close(self):
+        self.tracer.close()
+    def getSeen(self):
+        return self.seen
+    def getForwarded(self):
+        return self.forwarded
+
+def eventRecord(kind, fields):
+    # An event as a dict with 'kind', 'time' and the event's own fields. List
+    # fields (such as the current path) are copied, since searches keep
+    # changing them.
+    record = {'kind': kind, 'time': time.time()}
+    for key in fields:
+        value = fields[key]
+        record[key] = value[:] if isinstance(value, list) else value
+    return record
+
+class RingBufferTracer(Tracer):
+    """
+    Keeps the most recent capacity events in memory.
+    """
+    enabled = True
+    def __init__(self, capacity = 10000):
+        self.events = collections.deque(maxlen=capacity)
+    def event(self, kind, **fields):
+        self.events.append(eventRecord(kind, fields))
+    def getEvents(self):
+        return list(self.events)
+    def clear(self):
+        self.events.clear()
+
+class JsonlTracer(Tracer):
+    """
+    Writes events as JSON Lines to a file object or a filename (appended to).
+    """
+    enabled = True
+    def __init__(self, outFile):
+        if hasattr(outFile, 'write'):
+            self.outFile = outFile
+            self.ownsFile = False
+        else:
+            self.outFile = open(outFile, 'a')
+            self.ownsFile = True
+    def event(self, kind, **fields):
+        self.outFile.write(json.dumps(eventRecord(kind, fields)) + '\n')
+    def close(self):
+        if self.ownsFile:
+            self.outFile.close()
+        else:
+            self.outFile.flush()
+
+class PrintTracer(Tracer):
+    """
+    Prints search progress to stdout the way the searches used to, for
+    debugging small maps by eye.
+    """
+    enabled = True
+    def event(self, kind, **fields):
+        if kind == 'expand':
+            print("Current " + fields['search'] + " Path:", '->'.join(fields['path']))
+        elif kind == 'dead':
+            print(fields['reason'] + ", marking dead node")
+        elif kind == 'load':
+            print("Loaded map from file:", fields['source'])
+
+NULL_TRACER = Tracer()
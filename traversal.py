@@ -3,9 +3,21 @@
 # Finding shortest paths through MIT buildings
 #
 
+import heapq
+import math
+import multiprocessing
+import os
 import string
+import time
+from array import array
 # This imports everything from `graph.py` as if it was defined in this file!
 from graph import * 
+from tracing import *
+
+INFINITY = float('inf')
+DEADLINE_CHECK_INTERVAL = 1024 ## label pops between deadline checks
+WORKER_CHECK_INTERVAL = 1.0 ## seconds between checks that pool workers are alive
+ITINERARY_EXACT_STOPS = 8 ## most stops planItinerary orders exactly
 
 #
 # Problem 2: Building up the Campus Map
@@ -18,12 +30,17 @@ from graph import *
 # which is represented by the edge chosen from one node to another.
 #
 
-def load_map(mapFilename):
+def load_map(mapFilename, cache = False, tracer = NULL_TRACER):
     """ 
     Parses the map file and constructs a directed graph
 
     Parameters: 
-        mapFilename : name of the map file
+        mapFilename : name of the map file, or an open text file. A relative
+            name that does not exist in the current directory is looked up
+            next to this module.
+        cache: if True, parse through load_compact_map so that the binary
+            cache next to the map file is used (and refreshed)
+        tracer: a Tracer told about the load once it is done
 
     Assumes:
         Each entry in the map file consists of the following four positive 
@@ -36,27 +53,178 @@ def load_map(mapFilename):
     Returns:
         a directed graph representing the map
     """
-    # TODO
-    print("Loading map from file...")
-    g = WeightedDigraph()
-    pathAndFile = '/home/human/edX/6.00.2x/Python Problem Sets/PS5/ProblemSet5/'+mapFilename
-    inFile = open(pathAndFile, 'r')
-    for line in inFile:
-        edgeAsList = line.split()
-        if not g.hasNodeName(edgeAsList[0]):
-            g.addNode(Node(edgeAsList[0]))
-        if not g.hasNodeName(edgeAsList[1]):
-            g.addNode(Node(edgeAsList[1]))
-        g.addEdge(WeightedEdge(g.getNode(edgeAsList[0]), g.getNode(edgeAsList[1]), \
-                        float(edgeAsList[2]), float(edgeAsList[3])))  
+    began = time.perf_counter()
+    if cache:
+        g = load_compact_map(mapFilename).toWeightedDigraph()
+    else:
+        g = CompactDigraph.fromMapFile(findMapFile(mapFilename)).toWeightedDigraph()
+    if tracer.enabled and tracer.wants('load'):
+        tracer.event('load', source=str(getattr(mapFilename, 'name', mapFilename)), \
+            nodes=len(g.nodes), edges=g.toCompact().numEdges(), \
+            seconds=time.perf_counter() - began)
     return g
 
+def load_compact_map(mapFilename, cache = True):
+    """
+    Loads a map file as a CompactDigraph.
+
+    With cache set, the parsed graph is written to mapFilename + '.cache'
+    the first time, and later calls memory-map that file instead of parsing
+    the text again. The cache records the size and modification time of the
+    map file and is rebuilt whenever they change.
+
+    Parameters:
+        mapFilename : name of the map file, or an open text file (which is
+            always parsed, since it has no cache location)
+        cache: whether to read and write the binary cache
+
+    Returns:
+        a CompactDigraph representing the map
+    """
+    mapFile = findMapFile(mapFilename)
+    if not cache or hasattr(mapFile, 'read'):
+        return CompactDigraph.fromMapFile(mapFile)
+    info = os.stat(mapFile)
+    stamp = (info.st_size, info.st_mtime_ns)
+    cacheFilename = mapFile + '.cache'
+    try:
+        compact, cachedStamp = CompactDigraph.load(cacheFilename)
+        if cachedStamp == stamp:
+            return compact
+    except (OSError, ValueError):
+        pass
+    compact = CompactDigraph.fromMapFile(mapFile)
+    try:
+        compact.save(cacheFilename, stamp)
+    except OSError:
+        pass ## a read-only map directory just means no cache
+    return compact
+
+def findMapFile(mapFilename):
+    # Resolves a map filename against the current directory, then this module
+    if hasattr(mapFilename, 'read') or os.path.exists(mapFilename):
+        return mapFilename
+    besideModule = os.path.join(os.path.dirname(os.path.abspath(__file__)), \
+        mapFilename)
+    if os.path.exists(besideModule):
+        return besideModule
+    return mapFilename
+
+def load_coordinates(mapFilename, coordFilename = None):
+    """
+    Reads the building positions that go with a map file.
+
+    Parameters:
+        mapFilename : name of the map file
+        coordFilename: name of the coordinates file, by default
+            mapFilename + '.coords'
+
+    Assumes:
+        Each line of the coordinates file holds a building number and its
+        position, separated by blank spaces:
+            Building X Y
+        e.g.
+            32 410.5 122
+        Every building in the map needs a position for aStarSearch.
+
+    Returns:
+        a Coordinates object
+    """
+    if coordFilename is None:
+        coordFilename = findMapFile(mapFilename) + '.coords'
+    return Coordinates(readCoordinates(findMapFile(coordFilename)))
+
 #
 # Problem 3: Finding the Shortest Path using Brute Force Search
 #
 # State the optimization problem as a function to minimize
 # and what the constraints are
 #
+# The depth-first searches below share one SearchState per query: the path
+# being explored lives on a single stack of CompactDigraph node indices, with
+# an on-path bitmap and the running total and outdoor distances pushed and
+# popped alongside it. Extending the path by one edge is O(1), and a branch is
+# abandoned as soon as it goes past either limit.
+#
+# The searches are iterative: next to the path they keep an explicit stack of
+# frames, each holding the position of the next edge to try out of the node
+# at that depth. Paths can be as deep as the graph without touching Python's
+# recursion limit, and no path prefix is ever copied.
+#
+
+class SearchState(object):
+    """
+    The path being explored by a depth-first search, its running distances,
+    and the best satisfying path found so far.
+    """
+    def __init__(self, digraph, path, shortest):
+        self.graph = digraph.toCompact()
+        self.path = [] ## node indices
+        self.onPath = bytearray(self.graph.numNodes())
+        self.totals = [] ## total distance of path[:i+1], for each i
+        self.outdoors = [] ## outdoor distance of path[:i+1], for each i
+        for name in path:
+            node = self.graph.getIndex(name)
+            if not self.path:
+                self.push(node, 0.0, 0.0)
+            else:
+                e = self.graph.findEdge(self.path[-1], node)
+                self.push(node, self.totals[-1] + self.graph.totals[e], \
+                    self.outdoors[-1] + self.graph.outdoors[e])
+        self.bestPath = shortest
+        if shortest == None:
+            self.bestTotal = INFINITY
+        else:
+            self.bestTotal = digraph.getTotalDistance(shortest)
+    def push(self, node, total, outdoor):
+        self.path.append(node)
+        self.onPath[node] = 1
+        self.totals.append(total)
+        self.outdoors.append(outdoor)
+    def pop(self):
+        self.onPath[self.path.pop()] = 0
+        self.totals.pop()
+        self.outdoors.pop()
+    def isOnPath(self, node):
+        return self.onPath[node] == 1
+    def getTotal(self):
+        return self.totals[-1]
+    def getOutdoor(self):
+        return self.outdoors[-1]
+    def getNames(self):
+        names = self.graph.names
+        return [names[node] for node in self.path]
+    def offer(self):
+        # Called when the path has reached end; keeps it if it is shorter
+        if self.getTotal() < self.bestTotal:
+            self.bestTotal = self.getTotal()
+            self.bestPath = self.getNames()
+
+def startSearch(digraph, start, end, path, shortest):
+    """
+    Validates start and end, and builds the SearchState for a depth-first
+    search that continues path (a list of building numbers ending just
+    before start).
+
+    Returns:
+        A tuple (state, endIndex)
+    """
+    assert type(start) == str, "start must be passed to bruteForceSearch as str"
+    assert type(end) == str, "end must be passed to bruteForceSearch as str"
+
+    startNode = digraph.getNode(start)
+    endNode = digraph.getNode(end)
+
+    assert digraph.hasNode(startNode), "start node is not in the weighted digraph"
+    assert digraph.hasNode(endNode), "end node is not in the weighted digraph"
+    state = SearchState(digraph, path + [start], shortest)
+    return state, state.graph.getIndex(end)
+
+def finishSearch(state, path):
+    if len(path) == 0 and state.bestPath == None:
+        raise ValueError("No path satisfies the constraints")
+    else:
+        return state.bestPath
 
 def bruteForceSearch(digraph, start, end, maxTotalDist, maxDistOutdoors, path = [], shortest = None):    
     """
@@ -86,38 +254,88 @@ def bruteForceSearch(digraph, start, end, maxTotalDist, maxDistOutdoors, path =
         If there exists no path that satisfies maxTotalDist and
         maxDistOutdoors constraints, then raises a ValueError.
     """
-    assert type(start) == str, "start must be passed to bruteForceSearch as str"
-    assert type(end) == str, "end must be passed to bruteForceSearch as str"
-    
-    startNode = digraph.getNode(start)
-    endNode = digraph.getNode(end)
-    
-    assert digraph.hasNode(startNode), "start node is not in the weighted digraph"
-    assert digraph.hasNode(endNode), "end node is not in the weighted digraph"
-    path = path + [start]
-    if startNode == endNode:
-        return path
-    for node in digraph.childrenOf(startNode):
-        if node.getName() not in path: # To avoid cycles
-            newPath = bruteForceSearch(digraph, node.getName(), end,\
-                maxTotalDist, maxDistOutdoors, path, shortest)
-            if newPath != None \
-                and digraph.pathMeetsBothConstraints(newPath, maxTotalDist, \
-                    maxDistOutdoors):
-                if shortest == None:
-                    shortest = newPath
-                elif digraph.getTotalDistance(newPath) < \
-                    digraph.getTotalDistance(shortest):
-                    shortest = newPath                    
-    if len(path) == 1 and shortest == None:
-        raise ValueError("No path satisfies the constraints")
-    else:
-        return shortest
+    state, endNode = startSearch(digraph, start, end, path, shortest)
+    if state.getTotal() <= maxTotalDist and state.getOutdoor() <= maxDistOutdoors:
+        bruteForceExtend(state, endNode, maxTotalDist, maxDistOutdoors)
+    return finishSearch(state, path)
+
+def bruteForceExtend(state, endIndex, maxTotalDist, maxDistOutdoors):
+    # Explores every simple path that continues state.path
+    graph = state.graph
+    offsets, targets = graph.offsets, graph.targets
+    totals, outdoors = graph.totals, graph.outdoors
+    if state.path[-1] == endIndex:
+        state.offer()
+        return
+    frames = [offsets[state.path[-1]]] ## next edge to try at each depth
+    while frames:
+        e = frames[-1]
+        if e == offsets[state.path[-1] + 1]:
+            frames.pop()
+            if frames:
+                state.pop()
+            continue
+        frames[-1] = e + 1
+        dest = targets[e]
+        if state.onPath[dest]: # To avoid cycles
+            continue
+        tot = state.getTotal() + totals[e]
+        outs = state.getOutdoor() + outdoors[e]
+        if tot > maxTotalDist or outs > maxDistOutdoors:
+            continue
+        state.push(dest, tot, outs)
+        if dest == endIndex:
+            state.offer()
+            state.pop()
+        else:
+            frames.append(offsets[dest])
 
 #
 # Problem 4: Finding the Shorest Path using Optimized Search Method
 #
-def directedDFS(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path = [], shortest = None):
+# directedDFS is a branch-and-bound search. Before it starts, two Dijkstra
+# searches run backwards from end to find, for every node, the least total
+# and the least outdoor distance still needed to reach end. These never
+# overestimate, so a branch can be cut as soon as its distances so far plus
+# these bounds pass either limit, or the total can no longer beat the best
+# path found.
+#
+
+def shortestDistances(graph, source, weights):
+    """
+    Runs Dijkstra's algorithm on a CompactDigraph out of source (an index),
+    using one of its weight arrays (graph.totals or graph.outdoors).
+
+    Returns:
+        An array of the least distance from source to every node
+        (inf where unreachable)
+    """
+    offsets, targets = graph.offsets, graph.targets
+    distances = array('d', [INFINITY]) * graph.numNodes()
+    distances[source] = 0.0
+    queue = [(0.0, source)]
+    while queue:
+        dist, node = heapq.heappop(queue)
+        if dist > distances[node]:
+            continue
+        for e in range(offsets[node], offsets[node + 1]):
+            newDist = dist + weights[e]
+            if newDist < distances[targets[e]]:
+                distances[targets[e]] = newDist
+                heapq.heappush(queue, (newDist, targets[e]))
+    return distances
+
+def lowerBoundsToEnd(graph, endIndex):
+    """
+    Returns a tuple (totalToEnd, outdoorToEnd) of arrays holding, for each
+    node, the least total and the least outdoor distance of any path from it
+    to endIndex. Both are computed over the reversed graph.
+    """
+    reverse = graph.getReverse()
+    return shortestDistances(reverse, endIndex, reverse.totals), \
+        shortestDistances(reverse, endIndex, reverse.outdoors)
+
+def directedDFS(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path = [], shortest = None, tracer = NULL_TRACER):
     """
     Finds the shortest path from start to end using directed depth-first.
     search approach. The total distance travelled on the path must not
@@ -129,6 +347,7 @@ def directedDFS(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path
         start, end: start & end building numbers (strings)
         maxTotalDist : maximum total distance on a path (integer)
         maxDistOutdoors: maximum distance spent outdoors on a path (integer)
+        tracer: a Tracer told about each step (see tracing.py)
 
     Assumes:
         start and end are numbers for existing buildings in graph
@@ -142,49 +361,17 @@ def directedDFS(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path
         If there exists no path that satisfies maxTotalDist and
         maxDistOutdoors constraints, then raises a ValueError.
     """
-    assert type(start) == str, "start must be passed to bruteForceSearch as str"
-    assert type(end) == str, "end must be passed to bruteForceSearch as str"
+    state, endNode = startSearch(digraph, start, end, path, shortest)
+    route.startTimer()
+    try:
+        if state.getTotal() <= maxTotalDist and state.getOutdoor() <= maxDistOutdoors:
+            prunedExtend(state, route, endNode, maxTotalDist, maxDistOutdoors, \
+                lowerBoundsToEnd(state.graph, endNode), "DFS", tracer)
+    finally:
+        route.stopTimer()
+    return finishSearch(state, path)
     
-    startNode = digraph.getNode(start)
-    endNode = digraph.getNode(end)
-
-    assert digraph.hasNode(startNode), "start node is not in the weighted digraph"
-    assert digraph.hasNode(endNode), "end node is not in the weighted digraph"
-    path = path + [start]
-    route.addStep()
-    printPath(path, "DFS")
-    if startNode == endNode:
-        return path
-    if not digraph.hasChildNodes(startNode):
-        print("No children, marking dead node")
-        route.markNodeDead(start)
-    for node in digraph.childrenOf(startNode):
-        if not route.isDeadNode(node.getName()):
-            break
-    else:
-        print("No non-dead children nodes, marking dead node")
-        route.markNodeDead(start)
-        return shortest
-    for node in digraph.childrenOf(startNode):
-        if shortest == None or \
-            digraph.getTotalDistance(path) < digraph.getTotalDistance(shortest):
-            if (node.getName() not in path) and (not route.isDeadNode(node.getName())): # To avoid cycles
-                newPath = directedDFS(digraph, node.getName(), end, route,\
-                    maxTotalDist, maxDistOutdoors, path, shortest)
-                if newPath != None \
-                    and digraph.pathMeetsBothConstraints(newPath, maxTotalDist, \
-                        maxDistOutdoors):
-                    if shortest == None:
-                        shortest = newPath
-                    elif digraph.getTotalDistance(newPath) < \
-                        digraph.getTotalDistance(shortest):
-                        shortest = newPath                    
-    if len(path) == 1 and shortest == None:
-        raise ValueError("No path satisfies the constraints")
-    else:
-        return shortest
-    
-def bruteForcePruneSearch(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path = [], shortest = None):    
+def bruteForcePruneSearch(digraph, start, end, route, maxTotalDist, maxDistOutdoors, path = [], shortest = None, tracer = NULL_TRACER):    
     """
     Finds the shortest path from start to end using brute-force approach.
     The total distance travelled on the path must not exceed maxTotalDist, and
@@ -199,6 +386,7 @@ def bruteForcePruneSearch(digraph, start, end, route, maxTotalDist, maxDistOutdo
         maxDistOutdoors: maximum distance spent outdoors on a path (integer)
         path: the path traveled so far (list)
         shortest: the shortest satisfying path seen so far (list)
+        tracer: a Tracer told about each step (see tracing.py)
 
     Assumes:
         start and end are numbers for existing buildings in graph
@@ -212,46 +400,1133 @@ def bruteForcePruneSearch(digraph, start, end, route, maxTotalDist, maxDistOutdo
         If there exists no path that satisfies maxTotalDist and
         maxDistOutdoors constraints, then raises a ValueError.
     """
-    assert type(start) == str, "start must be passed to bruteForceSearch as str"
-    assert type(end) == str, "end must be passed to bruteForceSearch as str"
-    
-    startNode = digraph.getNode(start)
-    endNode = digraph.getNode(end)
-    
-    assert digraph.hasNode(startNode), "start node is not in the weighted digraph"
-    assert digraph.hasNode(endNode), "end node is not in the weighted digraph"
-    route.addStep()
-    path = path + [start]
-    printPath(path, "Prune")
-    if startNode == endNode:
-        return path
-    if not digraph.hasChildNodes(startNode):
-        print("No children, marking dead node")
-        route.markNodeDead(start)
-    for node in digraph.childrenOf(startNode):
-        if not route.isDeadNode(node.getName()):
+    state, endNode = startSearch(digraph, start, end, path, shortest)
+    route.startTimer()
+    try:
+        if state.getTotal() <= maxTotalDist and state.getOutdoor() <= maxDistOutdoors:
+            prunedExtend(state, route, endNode, maxTotalDist, \
+                maxDistOutdoors, None, "Prune", tracer)
+    finally:
+        route.stopTimer()
+    return finishSearch(state, path)
+
+def prunedExtend(state, route, endIndex, maxTotalDist, maxDistOutdoors, bounds, kind, tracer):
+    # Depth-first search shared by directedDFS and bruteForcePruneSearch.
+    # Nodes whose children are all dead are recorded on route. bounds is None
+    # or the (totalToEnd, outdoorToEnd) arrays from lowerBoundsToEnd, used to
+    # cut branches that cannot fit the limits or beat the best path found.
+    graph = state.graph
+    names = graph.names
+    offsets, targets = graph.offsets, graph.targets
+    totals, outdoors = graph.totals, graph.outdoors
+    if bounds:
+        totalToEnd, outdoorToEnd = bounds
+    frames = [] ## next edge to try at each depth
+    def enter(node):
+        # Visits the node just pushed; True if its children should be tried
+        route.addStep()
+        if tracer.enabled and tracer.wants('expand'):
+            tracer.event('expand', search=kind, path=state.getNames(), \
+                total=state.getTotal(), outdoor=state.getOutdoor())
+        if node == endIndex:
+            if tracer.enabled and state.getTotal() < state.bestTotal \
+                and tracer.wants('found'):
+                tracer.event('found', search=kind, path=state.getNames(), \
+                    total=state.getTotal(), outdoor=state.getOutdoor())
+            state.offer()
+            return False
+        for e in range(offsets[node], offsets[node + 1]):
+            if not route.isDeadNode(names[targets[e]]):
+                return True
+        if tracer.enabled and tracer.wants('dead'):
+            if offsets[node] == offsets[node + 1]:
+                reason = "No children"
+            else:
+                reason = "No non-dead children nodes"
+            tracer.event('dead', search=kind, node=names[node], reason=reason)
+        route.markNodeDead(names[node])
+        return False
+    if enter(state.path[-1]):
+        frames.append(offsets[state.path[-1]])
+    while frames:
+        e = frames[-1]
+        end = offsets[state.path[-1] + 1]
+        if e < end and bounds and not state.getTotal() < state.bestTotal:
+            route.pruneByBound(end - e)
+            e = end
+        if e == end:
+            frames.pop()
+            if frames:
+                state.pop()
+            continue
+        frames[-1] = e + 1
+        dest = targets[e]
+        if state.onPath[dest]: # To avoid cycles
+            continue
+        if route.isDeadNode(names[dest]):
+            route.pruneByDeadNode()
+            continue
+        tot = state.getTotal() + totals[e]
+        outs = state.getOutdoor() + outdoors[e]
+        if tot > maxTotalDist or outs > maxDistOutdoors:
+            route.pruneByBudget()
+            continue
+        if bounds and (tot + totalToEnd[dest] > maxTotalDist \
+            or outs + outdoorToEnd[dest] > maxDistOutdoors \
+            or not tot + totalToEnd[dest] < state.bestTotal):
+            route.pruneByBound()
+            continue
+        state.push(dest, tot, outs)
+        if enter(dest):
+            frames.append(offsets[dest])
+        else:
+            state.pop()
+
+#
+# Problem 5: Finding the Shortest Path using Label-Setting Search
+#
+# Every partial route is summarised by a label (total, outdoor) at the node it
+# ends on. A label is only worth extending if no other label at the same node
+# is at least as good in both distances (Pareto dominance).
+#
+# Labels are settled in increasing (total, outdoor) order, so every label
+# already settled at a node has a total no larger than the one being looked at.
+# That label is therefore dominated unless its outdoor distance is strictly
+# smaller than every outdoor distance settled there before, which makes the
+# dominance test a single comparison per node.
+#
+
+class SearchTimeoutError(TimeoutError):
+    """
+    Raised by settleLabels when its deadline passes. labels and settled
+    hold what the search had settled by then, which is final as far as it
+    goes.
+    """
+    def __init__(self, message, labels = None, settled = None):
+        TimeoutError.__init__(self, message)
+        self.labels = labels
+        self.settled = settled
+    def __reduce__(self):
+        # The partial search stays behind when the error leaves a worker
+        return self.__class__, self.args
+
+def settleLabels(digraph, start, maxTotalDist, maxDistOutdoors, end = None, deadline = None, frontier = False, ends = None):
+    """
+    Runs a label-setting search out of start, keeping only labels that
+    satisfy both distance constraints. The search itself runs on the
+    CompactDigraph form of digraph and never touches Node objects.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start: start building number (string)
+        maxTotalDist : maximum total distance on a path
+        maxDistOutdoors: maximum distance spent outdoors on a path
+        end: optional building number; the search stops as soon as the
+            first (and therefore shortest) label reaches it
+        deadline: optional time.monotonic() value after which the search
+            gives up by raising SearchTimeoutError
+        frontier: if True (and end is given), keep going after end is first
+            reached until all of its Pareto-optimal labels are settled,
+            dropping any label with no less outdoor distance than the best
+            one already at end
+        ends: optional dict mapping CompactDigraph indices to outdoor
+            budgets; the search stops once every one of them has a label
+            settled within its budget
+
+    Returns:
+        A tuple (labels, settled). labels is a list of
+        (total, outdoor, node, parent) tuples, where node is a CompactDigraph
+        index and parent is the index of the label this one was extended
+        from (-1 for start). settled maps the index of each reached node to
+        its Pareto-optimal labels, in increasing total (and decreasing
+        outdoor) order.
+    """
+    graph = digraph.toCompact()
+    offsets, targets = graph.offsets, graph.targets
+    totals, outdoors = graph.totals, graph.outdoors
+    endIndex = -1 if end is None else graph.getIndex(end)
+    labels = [(0.0, 0.0, graph.getIndex(start), -1)]
+    queue = [(0.0, 0.0, 0)]
+    settled = {}
+    minOutdoor = {} ## stores node:smallest outdoor distance settled there
+    endOutdoor = INFINITY ## no label with at least this much outdoors can help
+    pending = None if ends is None else dict(ends) ## ends still to be reached
+    pops = 0
+    while queue:
+        tot, outs, label = heapq.heappop(queue)
+        pops += 1
+        if deadline is not None and pops % DEADLINE_CHECK_INTERVAL == 0 \
+            and time.monotonic() > deadline:
+            raise SearchTimeoutError("Search ran past its deadline", labels, \
+                settled)
+        node = labels[label][2]
+        if outs >= minOutdoor.get(node, INFINITY):
+            continue
+        minOutdoor[node] = outs
+        settled.setdefault(node, []).append(label)
+        if node == endIndex:
+            if not frontier or outs == 0:
+                break
+            endOutdoor = outs
+            continue
+        if pending is not None and outs <= pending.get(node, -1.0):
+            del pending[node]
+            if not pending:
+                break
+        for e in range(offsets[node], offsets[node + 1]):
+            newTot = tot + totals[e]
+            newOuts = outs + outdoors[e]
+            dest = targets[e]
+            if newTot > maxTotalDist or newOuts > maxDistOutdoors \
+                or newOuts >= endOutdoor \
+                or newOuts >= minOutdoor.get(dest, INFINITY):
+                continue
+            labels.append((newTot, newOuts, dest, label))
+            heapq.heappush(queue, (newTot, newOuts, len(labels) - 1))
+    return labels, settled
+
+def labelPath(digraph, labels, label):
+    """
+    Walks the parent links of a label from settleLabels back to the start.
+
+    Returns:
+        The path ending at label, as a list of building numbers (strings)
+    """
+    names = digraph.toCompact().names
+    path = []
+    while label != -1:
+        path.append(names[labels[label][2]])
+        label = labels[label][3]
+    path.reverse()
+    return path
+
+def labelSettingSearch(digraph, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the shortest path from start to end using a label-setting search.
+    The total distance travelled on the path must not exceed maxTotalDist, and
+    the distance spent outdoor on this path must not exceed maxDistOutdoors.
+
+    Unlike the depth-first searches above, this never enumerates simple
+    paths: each node keeps only its non-dominated labels, so the work done
+    grows with the number of Pareto-optimal (total, outdoor) trade-offs
+    rather than with the number of paths in the graph.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start, end: start & end building numbers (strings)
+        maxTotalDist : maximum total distance on a path (integer)
+        maxDistOutdoors: maximum distance spent outdoors on a path (integer)
+
+    Returns:
+        The shortest-path from start to end, represented by
+        a list of building numbers (in strings), [n_1, n_2, ..., n_k],
+        where there exists an edge from n_i to n_(i+1) in digraph,
+        for all 1 <= i < k.
+
+        If there exists no path that satisfies maxTotalDist and
+        maxDistOutdoors constraints, then raises a ValueError.
+    """
+    return labelSettingRoute(digraph, start, end, maxTotalDist, \
+        maxDistOutdoors)[0]
+
+def labelSettingRoute(digraph, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the same path as labelSettingSearch, along with its distances. On a
+    graph with parallel edges these are the distances of the edges the search
+    took, which the path alone does not tell apart.
+
+    Returns:
+        A tuple (path, total, outdoor). Raises a ValueError if there exists
+        no path that satisfies both constraints.
+    """
+    labels, settled = settleLabels(digraph, start, maxTotalDist, \
+        maxDistOutdoors, end)
+    endIndex = digraph.toCompact().getIndex(end)
+    if endIndex not in settled:
+        raise ValueError("No path satisfies the constraints")
+    label = settled[endIndex][0]
+    return labelPath(digraph, labels, label), labels[label][0], \
+        labels[label][1]
+
+
+def paretoFrontier(digraph, start, end, maxTotalDist = INFINITY, maxDistOutdoors = INFINITY):
+    """
+    Finds every Pareto-optimal route from start to end: each route on the
+    frontier is the shortest one that keeps outdoor distance at or below its
+    own, so one call answers the question for any outdoor budget (see
+    bestOnFrontier).
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start, end: start & end building numbers (strings)
+        maxTotalDist : optional maximum total distance on a path
+        maxDistOutdoors: optional maximum distance spent outdoors on a path
+
+    Returns:
+        A list of (path, total, outdoor) tuples in increasing total and
+        strictly decreasing outdoor order, where path is a list of building
+        numbers (strings). The list is empty if end cannot be reached within
+        the constraints.
+    """
+    labels, settled = settleLabels(digraph, start, maxTotalDist, \
+        maxDistOutdoors, end, frontier = True)
+    frontier = []
+    for label in settled.get(digraph.toCompact().getIndex(end), []):
+        frontier.append((labelPath(digraph, labels, label), \
+            labels[label][0], labels[label][1]))
+    return frontier
+
+def bestOnFrontier(frontier, maxTotalDist, maxDistOutdoors):
+    """
+    Picks the answer to a single query from the result of paretoFrontier.
+
+    Returns:
+        The shortest path on frontier satisfying both constraints. Raises a
+        ValueError if there is none.
+    """
+    for path, total, outdoor in frontier:
+        if outdoor <= maxDistOutdoors:
+            if total <= maxTotalDist:
+                return path
             break
-    else:
-        print("No non-dead children nodes, marking dead node")
-        route.markNodeDead(start)
-        return shortest
-    for node in digraph.childrenOf(startNode):
-        if (node.getName() not in path) and (not route.isDeadNode(node.getName())): # To avoid cycles
-            newPath = bruteForcePruneSearch(digraph, node.getName(), end, route,\
-                maxTotalDist, maxDistOutdoors, path, shortest)
-            if newPath != None \
-                and digraph.pathMeetsBothConstraints(newPath, maxTotalDist, \
-                    maxDistOutdoors):
-                if shortest == None:
-                    shortest = newPath
-                elif digraph.getTotalDistance(newPath) < \
-                    digraph.getTotalDistance(shortest):
-                    shortest = newPath                    
-    if len(path) == 1 and shortest == None:
+    raise ValueError("No path satisfies the constraints")
+
+def reachableWithin(digraph, start, maxTotalDist, maxDistOutdoors, frontier = False):
+    """
+    Finds every building reachable from start within both distance budgets,
+    with one label-setting search instead of one search per destination.
+    No label past either budget is ever queued, so the work done grows
+    with the reachable region rather than with the whole map.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start: start building number (string)
+        maxTotalDist : maximum total distance on a path
+        maxDistOutdoors: maximum distance spent outdoors on a path
+        frontier: if True, give every Pareto-optimal (total, outdoor) pair
+            for each building instead of just the shortest
+
+    Returns:
+        A dict mapping each reachable building number (string), start
+        included, to the (total, outdoor) distances of its shortest route
+        within both budgets (the least outdoor one among equally short
+        routes). With frontier set, each building maps to a list of
+        (total, outdoor) pairs in increasing total and strictly decreasing
+        outdoor order.
+    """
+    labels, settled = settleLabels(digraph, start, maxTotalDist, maxDistOutdoors)
+    names = digraph.toCompact().names
+    reachable = {}
+    for node in settled:
+        if frontier:
+            reachable[names[node]] = [labels[label][:2] for label in settled[node]]
+        else:
+            reachable[names[node]] = labels[settled[node][0]][:2]
+    return reachable
+
+#
+# Bidirectional search runs two label-setting searches at once: one forward
+# from start, and one from end over the reversed graph, whose labels are the
+# distances still to go. Each step extends the side whose next label has the
+# smaller total, so both grow to about half the radius of a one-sided search.
+#
+# Whenever a label reaches a node the other side has settled labels at, the
+# pairs within both budgets are complete routes. Once the two smallest
+# totals left in the queues add up to the best such route, every shorter
+# route would have had to cross from a settled forward label to a settled
+# backward label along some edge, and that crossing was already checked.
+# If one queue runs dry, the other side keeps going until its smallest
+# total reaches the best route, as the contraction hierarchy search does.
+#
+
+def bidirectionalSearch(digraph, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the shortest path from start to end like labelSettingSearch, but
+    searching from both ends and meeting in the middle, which settles far
+    fewer labels when start and end are far apart.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start, end: start & end building numbers (strings)
+        maxTotalDist : maximum total distance on a path
+        maxDistOutdoors: maximum distance spent outdoors on a path
+
+    Returns:
+        The shortest path satisfying both constraints, as a list of
+        building numbers (strings). Raises ValueError if there is none.
+    """
+    forward = digraph.toCompact()
+    graphs = (forward, forward.getReverse())
+    labels = ([(0.0, 0.0, forward.getIndex(start), -1)], \
+        [(0.0, 0.0, forward.getIndex(end), -1)])
+    if start == end:
+        return [start]
+    queues = ([(0.0, 0.0, 0)], [(0.0, 0.0, 0)])
+    settled = ({}, {}) ## per side, stores node:labels settled there
+    minOutdoor = ({}, {}) ## per side, stores node:smallest outdoor distance settled
+    bestTotal = INFINITY
+    best = None ## the (forward, backward) labels of the best route so far
+    while queues[0] or queues[1]:
+        # A side whose queue has run dry has settled all it can reach, but
+        # the other side may still meet it (through zero-length edges, say)
+        tops = [queue[0][0] if queue else INFINITY for queue in queues]
+        side = 0 if tops[0] <= tops[1] else 1
+        other = 1 - side
+        if tops[side] >= bestTotal or tops[0] + tops[1] < INFINITY and \
+            tops[0] + tops[1] >= bestTotal:
+            break
+        tot, outs, label = heapq.heappop(queues[side])
+        node = labels[side][label][2]
+        if outs >= minOutdoor[side].get(node, INFINITY):
+            continue
+        minOutdoor[side][node] = outs
+        settled[side].setdefault(node, []).append(label)
+        for meet in settled[other].get(node, ()):
+            meetTot, meetOuts = labels[other][meet][:2]
+            if outs + meetOuts <= maxDistOutdoors and \
+                tot + meetTot <= maxTotalDist and tot + meetTot < bestTotal:
+                bestTotal = tot + meetTot
+                best = (label, meet) if side == 0 else (meet, label)
+        graph = graphs[side]
+        for e in range(graph.offsets[node], graph.offsets[node + 1]):
+            newTot = tot + graph.totals[e]
+            newOuts = outs + graph.outdoors[e]
+            dest = graph.targets[e]
+            if newTot > maxTotalDist or newOuts > maxDistOutdoors:
+                continue
+            newLabel = None
+            for meet in settled[other].get(dest, ()):
+                meetTot, meetOuts = labels[other][meet][:2]
+                if newOuts + meetOuts <= maxDistOutdoors and \
+                    newTot + meetTot <= maxTotalDist and \
+                    newTot + meetTot < bestTotal:
+                    if newLabel is None:
+                        labels[side].append((newTot, newOuts, dest, label))
+                        newLabel = len(labels[side]) - 1
+                    bestTotal = newTot + meetTot
+                    best = (newLabel, meet) if side == 0 else (meet, newLabel)
+            if newOuts >= minOutdoor[side].get(dest, INFINITY):
+                continue
+            if newLabel is None:
+                labels[side].append((newTot, newOuts, dest, label))
+                newLabel = len(labels[side]) - 1
+            heapq.heappush(queues[side], (newTot, newOuts, newLabel))
+    if best is None:
         raise ValueError("No path satisfies the constraints")
+    # Both halves end at the meeting node; the backward one runs from end
+    path = labelPath(forward, labels[0], best[0])
+    back = labelPath(forward, labels[1], best[1])
+    back.reverse()
+    return path + back[1:]
+
+#
+# Problem 6: Answering Many Queries at Once
+#
+# A label-setting search without an end settles the Pareto-optimal labels of
+# every node within its budgets. Queries that share a start can therefore be
+# answered from one search, run with the loosest budgets of the group: the
+# answer to each query is the first label at its end (in increasing total)
+# that fits that query's own budgets. The search stops as soon as every end
+# has such a label, rather than settling the whole reachable graph.
+#
+
+class QueryResult(object):
+    """
+    The outcome of one query in a batch: either a path, with the total and
+    outdoor distances the search found for it, or the error that the
+    single-query search would have raised.
+    """
+    def __init__(self, query, path = None, error = None, total = None, outdoor = None):
+        self.query = query
+        self.path = path
+        self.error = error
+        self.total = total
+        self.outdoor = outdoor
+    def getQuery(self):
+        return self.query
+    def getPath(self):
+        return self.path
+    def getTotal(self):
+        return self.total
+    def getOutdoor(self):
+        return self.outdoor
+    def getError(self):
+        return self.error
+    def isOk(self):
+        return self.error is None
+    def __str__(self):
+        if self.isOk():
+            return '{0}: {1}'.format(self.query, self.path)
+        return '{0}: {1}'.format(self.query, self.error)
+
+def bestLabel(labels, candidates, maxTotalDist, maxDistOutdoors):
+    """
+    Returns the first of candidates (label indices in increasing total, as
+    kept in settleLabels' settled lists) that satisfies both constraints, or
+    None if none of them does.
+    """
+    for label in candidates:
+        if labels[label][1] <= maxDistOutdoors:
+            if labels[label][0] <= maxTotalDist:
+                return label
+            return None
+    return None
+
+def batchSearch(digraph, queries):
+    """
+    Answers many shortest-path queries, searching once per distinct start.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        queries: a sequence of (start, end, maxTotalDist, maxDistOutdoors)
+            tuples, with start & end building numbers (strings)
+
+    Returns:
+        A list of QueryResult, one per query and in the same order. A query
+        with no satisfying path, or naming an unknown building, gets a
+        ValueError as its error instead of stopping the batch.
+    """
+    graph = digraph.toCompact()
+    results, groups = groupQueries(graph, queries)
+    for group in groups:
+        for i, result in answerGroup(graph, group):
+            results[i] = result
+    return results
+
+def groupQueries(graph, queries):
+    """
+    Checks a batch of queries and groups the valid ones by start.
+
+    Returns:
+        A tuple (results, groups). results has one slot per query, already
+        holding a QueryResult for each invalid one. groups is a list of
+        (start, [(position, query, end, maxTotal, maxOutdoors), ...]) pairs.
+    """
+    results = [None] * len(queries)
+    bySource = {} ## stores start:[checked queries]
+    for i in range(len(queries)):
+        try:
+            start, end, maxTotalDist, maxDistOutdoors = queries[i]
+            for name in (start, end):
+                if not graph.hasNodeName(name):
+                    raise ValueError('Unknown building {0}'.format(name))
+            checked = (i, queries[i], end, float(maxTotalDist), \
+                float(maxDistOutdoors))
+        except (TypeError, ValueError) as err:
+            results[i] = QueryResult(queries[i], error = ValueError(str(err)))
+            continue
+        bySource.setdefault(start, []).append(checked)
+    return results, list(bySource.items())
+
+def answerGroup(graph, group, deadline = None):
+    """
+    Answers the queries of one group from groupQueries with a single search.
+
+    Returns:
+        A list of (position, QueryResult) pairs. If deadline passes first,
+        each query not answered by then gets a TimeoutError.
+    """
+    start, members = group
+    # Once an end has a label within the smallest outdoor budget asked of
+    # it, later labels there have larger totals and cannot change an answer
+    ends = {}
+    for member in members:
+        endIndex = graph.getIndex(member[2])
+        ends[endIndex] = min(ends.get(endIndex, INFINITY), member[4])
+    maxTotalDist = max(member[3] for member in members)
+    maxDistOutdoors = max(member[4] for member in members)
+    timedOut = False
+    try:
+        labels, settled = settleLabels(graph, start, maxTotalDist, \
+            maxDistOutdoors, deadline = deadline, ends = ends)
+    except SearchTimeoutError as err:
+        # Queries whose end was already reached keep their answers
+        labels, settled = err.labels, err.settled
+        timedOut = True
+    answers = []
+    for i, query, end, maxTotalDist, maxDistOutdoors in members:
+        candidates = settled.get(graph.getIndex(end), [])
+        if timedOut and (not candidates or \
+            labels[candidates[-1]][1] > maxDistOutdoors):
+            answers.append((i, QueryResult(query, \
+                error = TimeoutError("Search ran past its deadline"))))
+            continue
+        label = bestLabel(labels, candidates, maxTotalDist, maxDistOutdoors)
+        if label is None:
+            answers.append((i, QueryResult(query, \
+                error = ValueError("No path satisfies the constraints"))))
+        else:
+            answers.append((i, QueryResult(query, \
+                labelPath(graph, labels, label), total = labels[label][0], \
+                outdoor = labels[label][1])))
+    return answers
+
+#
+# Problem 7: Spreading Queries across Processes
+#
+# Worker processes receive the CompactDigraph once, when they start. Where
+# the platform forks, they inherit its arrays (including a memory-mapped cache)
+# without copying or pickling, and never write to them.
+#
+
+workerGraph = None ## the CompactDigraph seen by a SearchPool worker
+
+def initSearchWorker(graph):
+    global workerGraph
+    workerGraph = graph
+
+def runSearchTask(task):
+    # Runs in a worker: answers one group, giving up after timeout seconds
+    group, timeout = task
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return answerGroup(workerGraph, group, deadline)
+
+class SearchPool(object):
+    """
+    A pool of worker processes answering batches of queries in parallel,
+    one group of queries sharing a start per task.
+
+    A search that runs longer than timeout seconds stops itself, and those
+    of its queries it has not answered yet get a TimeoutError. As a
+    backstop, a worker that has not answered within twice that is killed
+    and the pool restarted, so a stuck query never holds up the rest of the
+    batch. With or without a timeout, a worker that dies takes its task with
+    it, so the pool is also restarted if one does while answers are awaited.
+
+    The workers search a snapshot of digraph. If digraph changes, the
+    workers are restarted with a new snapshot at the next search.
+    """
+    def __init__(self, digraph, processes = None, timeout = None):
+        self.digraph = digraph
+        self.version = digraph.getVersion()
+        self.graph = digraph.toCompact()
+        self.processes = processes or os.cpu_count() or 1
+        self.timeout = timeout
+        self.pool = None
+        self.workers = set() ## stores the pids of the pool's worker processes
+    def start(self):
+        if self.pool is None:
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            others = set(child.pid for child in multiprocessing.active_children())
+            self.pool = context.Pool(self.processes, initSearchWorker, \
+                (self.graph,))
+            self.workers = set(child.pid for child in \
+                multiprocessing.active_children()) - others
+    def workersAlive(self):
+        # Whether every worker the pool started with is still running. The
+        # pool replaces a worker that dies, but the task it held is lost
+        alive = set(child.pid for child in multiprocessing.active_children())
+        return self.workers <= alive
+    def wait(self, fetch):
+        # Returns fetch(seconds), which raises multiprocessing.TimeoutError
+        # while the answer is not ready after that long, checking in between
+        # that no worker died. Raises multiprocessing.TimeoutError past the
+        # backstop, or ChildProcessError if a worker died
+        limit = None if self.timeout is None \
+            else time.monotonic() + 2 * self.timeout + 1
+        while True:
+            seconds = WORKER_CHECK_INTERVAL
+            if limit is not None:
+                seconds = max(0.0, min(seconds, limit - time.monotonic()))
+            try:
+                return fetch(seconds)
+            except multiprocessing.TimeoutError:
+                if limit is not None and time.monotonic() >= limit:
+                    raise
+                if not self.workersAlive():
+                    raise ChildProcessError("A search worker exited")
+    def search(self, queries):
+        """
+        Answers queries like batchSearch does, spreading the groups of
+        queries that share a start across the worker processes.
+
+        Returns:
+            A list of QueryResult, one per query and in the same order
+        """
+        self.refresh()
+        results, groups = groupQueries(self.graph, queries)
+        self.start()
+        answers = self.pool.imap_unordered(runSearchTask, \
+            [(group, self.timeout) for group in groups])
+        try:
+            for group in groups:
+                for i, result in self.wait(answers.next):
+                    results[i] = result
+        except (multiprocessing.TimeoutError, ChildProcessError) as err:
+            self.close()
+            if isinstance(err, multiprocessing.TimeoutError):
+                err = TimeoutError("Search was cancelled")
+            for i in range(len(results)):
+                if results[i] is None:
+                    results[i] = QueryResult(queries[i], error = err)
+        return results
+    def legs(self, sources, stops, maxTotalDist, maxDistOutdoors):
+        """
+        Runs stopLegs out of each of sources in the worker processes.
+
+        Returns:
+            A dict mapping each of sources to its stopLegs result. A search
+            running past the timeout raises TimeoutError, and a worker
+            dying raises ChildProcessError.
+        """
+        self.refresh()
+        self.start()
+        answers = self.pool.map_async(runLegsTask, [(source, stops, \
+            maxTotalDist, maxDistOutdoors, self.timeout) for source in sources])
+        try:
+            return dict(self.wait(answers.get))
+        except (multiprocessing.TimeoutError, ChildProcessError) as err:
+            self.close()
+            if isinstance(err, multiprocessing.TimeoutError):
+                raise TimeoutError("Search was cancelled")
+            raise
+    def refresh(self):
+        # Restarts the workers with a new snapshot if digraph has changed
+        if self.digraph.getVersion() != self.version:
+            self.close()
+            self.version = self.digraph.getVersion()
+            self.graph = self.digraph.toCompact()
+    def close(self):
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+    def __enter__(self):
+        self.start()
+        return self
+    def __exit__(self, *exc):
+        self.close()
+
+def parallelBatchSearch(digraph, queries, processes = None, timeout = None):
+    """
+    Answers queries like batchSearch, using a temporary SearchPool.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        queries: a sequence of (start, end, maxTotalDist, maxDistOutdoors)
+        processes: number of worker processes (default: one per CPU)
+        timeout: seconds a single search may run before it is cancelled
+
+    Returns:
+        A list of QueryResult, one per query and in the same order
+    """
+    pool = SearchPool(digraph, processes, timeout)
+    try:
+        return pool.search(queries)
+    finally:
+        pool.close()
+
+#
+# Problem 8: Alternative Routes
+#
+# kShortestPaths follows Yen's algorithm. Each new route leaves one of the
+# routes already found at some spur node: it shares that route's prefix (the
+# root), then takes a spur path that avoids the root's other nodes and every
+# next step already taken from the same root. The shortest spur path within
+# what is left of both budgets is found by a label-setting search ordered by
+# total plus the least total still needed to reach end.
+#
+# Those lower bounds come from the two shortest-path trees into end that
+# directedDFS uses, computed once per query. Blocking nodes and edges only
+# makes routes longer, so the bounds stay valid for every spur search, which
+# therefore heads almost straight for end instead of searching the map.
+#
+
+def spurSearch(graph, source, endIndex, maxTotalDist, maxDistOutdoors, bounds, blockedNodes, blockedTargets):
+    """
+    Finds the shortest route from source to endIndex (indices into graph)
+    within both limits, avoiding blockedNodes (a bytearray marking nodes)
+    and the edges from source to any node in blockedTargets.
+
+    Returns:
+        A list of (node, total, outdoor) steps, the distances being those
+        travelled since source, or None if there is no such route.
+    """
+    offsets, targets = graph.offsets, graph.targets
+    totals, outdoors = graph.totals, graph.outdoors
+    totalToEnd, outdoorToEnd = bounds
+    if blockedNodes[source] or totalToEnd[source] > maxTotalDist or \
+        outdoorToEnd[source] > maxDistOutdoors:
+        return None
+    labels = [(0.0, 0.0, source, -1)]
+    queue = [(totalToEnd[source], 0.0, 0)]
+    minOutdoor = {}
+    while queue:
+        estimate, outs, label = heapq.heappop(queue)
+        tot, outs, node, parent = labels[label]
+        if outs >= minOutdoor.get(node, INFINITY):
+            continue
+        minOutdoor[node] = outs
+        if node == endIndex:
+            steps = []
+            while label != -1:
+                tot, outs, node, parent = labels[label]
+                steps.append((node, tot, outs))
+                label = parent
+            steps.reverse()
+            return steps
+        for e in range(offsets[node], offsets[node + 1]):
+            dest = targets[e]
+            if blockedNodes[dest] or (node == source and dest in blockedTargets):
+                continue
+            newTot = tot + totals[e]
+            newOuts = outs + outdoors[e]
+            if newTot + totalToEnd[dest] > maxTotalDist or \
+                newOuts + outdoorToEnd[dest] > maxDistOutdoors or \
+                newOuts >= minOutdoor.get(dest, INFINITY):
+                continue
+            labels.append((newTot, newOuts, dest, label))
+            heapq.heappush(queue, (newTot + totalToEnd[dest], newOuts, \
+                len(labels) - 1))
+    return None
+
+def kShortestPaths(digraph, start, end, k, maxTotalDist = INFINITY, maxDistOutdoors = INFINITY):
+    """
+    Finds up to k routes from start to end that satisfy both constraints,
+    shortest first, such as the shortest route together with slightly longer
+    ones that stay indoors.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start, end: start & end building numbers (strings)
+        k: the most routes to return
+        maxTotalDist : optional maximum total distance on a path
+        maxDistOutdoors: optional maximum distance spent outdoors on a path
+
+    Returns:
+        A list of at most k (path, total, outdoor) tuples in increasing total
+        order, where each path is a different list of building numbers
+        (strings) that never visits a building twice. The list is empty if
+        no path satisfies the constraints.
+    """
+    graph = digraph.toCompact()
+    startIndex, endIndex = graph.getIndex(start), graph.getIndex(end)
+    bounds = lowerBoundsToEnd(graph, endIndex)
+    blockedNodes = bytearray(graph.numNodes())
+    first = spurSearch(graph, startIndex, endIndex, maxTotalDist, \
+        maxDistOutdoors, bounds, blockedNodes, ())
+    if first is None:
+        return []
+    found = [first] ## routes as lists of (node, total, outdoor) steps
+    seen = set([tuple(step[0] for step in first)])
+    candidates = [] ## heap of (total, outdoor, count, route)
+    while len(found) < k:
+        previous = found[-1]
+        for j in range(len(previous) - 1):
+            spurNode, rootTot, rootOuts = previous[j]
+            root = previous[:j + 1]
+            blockedTargets = set()
+            for route in found:
+                if len(route) > j + 1 and route[:j + 1] == root:
+                    blockedTargets.add(route[j + 1][0])
+            for node, tot, outs in root[:-1]:
+                blockedNodes[node] = 1
+            spur = spurSearch(graph, spurNode, endIndex, \
+                maxTotalDist - rootTot, maxDistOutdoors - rootOuts, bounds, \
+                blockedNodes, blockedTargets)
+            for node, tot, outs in root[:-1]:
+                blockedNodes[node] = 0
+            if spur is None:
+                continue
+            route = root[:-1] + [(node, rootTot + tot, rootOuts + outs) \
+                for node, tot, outs in spur]
+            key = tuple(step[0] for step in route)
+            if key not in seen:
+                seen.add(key)
+                heapq.heappush(candidates, (route[-1][1], route[-1][2], \
+                    len(seen), route))
+        if not candidates:
+            break
+        found.append(heapq.heappop(candidates)[3])
+    paths = []
+    for route in found:
+        paths.append(([graph.getName(step[0]) for step in route], \
+            route[-1][1], route[-1][2]))
+    return paths
+
+#
+# Problem 9: Goal-Directed Search with Building Positions
+#
+# A* is the label-setting search with every label ordered by its total plus
+# a lower bound on the total still to go, here the scaled straight-line
+# distance to end. The bound never drops by more than an edge's length
+# along that edge, so labels at one node still come off the queue in
+# increasing total order and the outdoor dominance test stays a single
+# comparison. Labels whose bound already passes maxTotalDist are never
+# queued, and the queue leans towards end, so far less of the map is
+# explored than by a search growing evenly in every direction.
+#
+
+def aStarSearch(digraph, coordinates, start, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the shortest path from start to end like labelSettingSearch, guided
+    towards end by the positions of the buildings.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        coordinates: a Coordinates object (see load_coordinates) giving a
+            position for every building of digraph
+        start, end: start & end building numbers (strings)
+        maxTotalDist : maximum total distance on a path
+        maxDistOutdoors: maximum distance spent outdoors on a path
+
+    Returns:
+        The shortest-path from start to end, as a list of building numbers
+        (strings). If there exists no path that satisfies maxTotalDist and
+        maxDistOutdoors constraints, then raises a ValueError.
+    """
+    graph = digraph.toCompact()
+    coordinates.prepare(graph)
+    xs, ys, scale = coordinates.xs, coordinates.ys, coordinates.scale
+    offsets, targets = graph.offsets, graph.targets
+    totals, outdoors = graph.totals, graph.outdoors
+    startIndex, endIndex = graph.getIndex(start), graph.getIndex(end)
+    endX, endY = xs[endIndex], ys[endIndex]
+    hypot = math.hypot
+    labels = [(0.0, 0.0, startIndex, -1)]
+    queue = [(scale * hypot(xs[startIndex] - endX, ys[startIndex] - endY), 0.0, 0)]
+    minOutdoor = {} ## stores node:smallest outdoor distance settled there
+    while queue:
+        estimate, outs, label = heapq.heappop(queue)
+        tot, outs, node, parent = labels[label]
+        if outs >= minOutdoor.get(node, INFINITY):
+            continue
+        minOutdoor[node] = outs
+        if node == endIndex:
+            return labelPath(graph, labels, label)
+        for e in range(offsets[node], offsets[node + 1]):
+            newOuts = outs + outdoors[e]
+            dest = targets[e]
+            if newOuts > maxDistOutdoors \
+                or newOuts >= minOutdoor.get(dest, INFINITY):
+                continue
+            newTot = tot + totals[e]
+            newEstimate = newTot + scale * hypot(xs[dest] - endX, ys[dest] - endY)
+            if newEstimate > maxTotalDist:
+                continue
+            labels.append((newTot, newOuts, dest, label))
+            heapq.heappush(queue, (newEstimate, newOuts, len(labels) - 1))
+    raise ValueError("No path satisfies the constraints")
+
+#
+# Problem 10: Visiting Several Buildings in One Trip
+#
+# A trip from start through a set of stops is made of legs between stops.
+# The outdoor budget covers the whole trip, so the shortest leg between two
+# stops is not always the one to take: every Pareto-optimal leg is kept,
+# and one label-setting search out of each stop finds all of its legs.
+#
+# Trips are then built from labels (total, outdoor, chain), where chain
+# links back through the legs taken. For a few stops, every subset of
+# stops visited and last stop reached keeps its Pareto-optimal labels, so
+# the best order is found exactly. For more, a nearest-neighbour order is
+# improved by reversing segments of it (2-opt) while that helps, each order
+# costed with the Pareto-optimal labels along it.
+#
+
+def stopLegs(digraph, start, stops, maxTotalDist, maxDistOutdoors, deadline = None):
+    """
+    Finds the Pareto-optimal routes from start to each of stops with a
+    single label-setting search.
+
+    Returns:
+        A dict mapping each of stops to a list of (total, outdoor, path)
+        tuples in increasing total and strictly decreasing outdoor order,
+        where path is a list of building numbers (strings). A stop that
+        cannot be reached within the constraints maps to an empty list.
+    """
+    graph = digraph.toCompact()
+    labels, settled = settleLabels(graph, start, maxTotalDist, \
+        maxDistOutdoors, deadline = deadline)
+    legs = {}
+    for stop in stops:
+        legs[stop] = [(labels[label][0], labels[label][1], \
+            labelPath(graph, labels, label)) \
+            for label in settled.get(graph.getIndex(stop), [])]
+    return legs
+
+def runLegsTask(task):
+    # Runs in a worker: the legs out of one stop, giving up after timeout seconds
+    start, stops, maxTotalDist, maxDistOutdoors, timeout = task
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return start, stopLegs(workerGraph, start, stops, maxTotalDist, \
+        maxDistOutdoors, deadline)
+
+def paretoLabels(labels):
+    # Keeps the labels no other label is at least as good as in both
+    # distances, in increasing total and strictly decreasing outdoor order
+    labels.sort(key=lambda label: label[:2])
+    kept = []
+    for label in labels:
+        if not kept or label[1] < kept[-1][1]:
+            kept.append(label)
+    return kept
+
+def extendLabels(labels, options, stop, maxTotalDist, maxDistOutdoors, extended):
+    # Appends to extended each of labels followed by each leg in options
+    # (to stop) that keeps the trip within both constraints
+    for tot, outs, chain in labels:
+        for leg in options:
+            newTot = tot + leg[0]
+            if newTot > maxTotalDist:
+                break ## the remaining legs are longer still
+            newOuts = outs + leg[1]
+            if newOuts <= maxDistOutdoors:
+                extended.append((newTot, newOuts, (chain, stop, leg)))
+
+def orderLabels(legs, start, stops, order, end, maxTotalDist, maxDistOutdoors):
+    # The Pareto-optimal labels of trips visiting stops in the given order
+    # (of positions in stops), then end if it is not None
+    labels = [(0.0, 0.0, None)]
+    source = start
+    for i in order + ([] if end is None else [-1]):
+        dest = end if i == -1 else stops[i]
+        extended = []
+        extendLabels(labels, legs[source][dest], i, maxTotalDist, \
+            maxDistOutdoors, extended)
+        labels = paretoLabels(extended)
+        source = dest
+    return labels
+
+def exactItinerary(legs, start, stops, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds the best trip over every order of stops, by dynamic programming
+    over (stops visited, last stop) states.
+
+    Returns:
+        The Pareto-optimal labels of complete trips
+    """
+    k = len(stops)
+    states = {(0, -1): [(0.0, 0.0, None)]} ## stores (mask, last):labels
+    finished = []
+    # A state only gains labels from smaller masks, so its labels are all
+    # in by the time it is reached in increasing mask order
+    for mask in range(1 << k):
+        for last in ([-1] if mask == 0 else range(k)):
+            if (mask, last) not in states:
+                continue
+            labels = paretoLabels(states.pop((mask, last)))
+            source = start if last == -1 else stops[last]
+            if mask == (1 << k) - 1:
+                if end is None:
+                    finished.extend(labels)
+                else:
+                    extendLabels(labels, legs[source][end], -1, maxTotalDist, \
+                        maxDistOutdoors, finished)
+                continue
+            for i in range(k):
+                if not mask & (1 << i):
+                    extendLabels(labels, legs[source][stops[i]], i, \
+                        maxTotalDist, maxDistOutdoors, \
+                        states.setdefault((mask | (1 << i), i), []))
+    return paretoLabels(finished)
+
+def heuristicItinerary(legs, start, stops, end, maxTotalDist, maxDistOutdoors):
+    """
+    Finds a good trip through many stops: nearest neighbour by shortest
+    leg, then 2-opt segment reversals while they shorten the trip or, while
+    no order fits the outdoor budget, bring it closer to fitting.
+
+    Returns:
+        The Pareto-optimal labels of the trip in the order found, which are
+        empty if that order cannot satisfy the constraints
+    """
+    def rank(order):
+        labels = orderLabels(legs, start, stops, order, end, maxTotalDist, \
+            maxDistOutdoors)
+        if labels:
+            return (0, labels[0][0]), labels
+        loose = orderLabels(legs, start, stops, order, end, INFINITY, INFINITY)
+        return (1 if loose else 2, loose[-1][1] if loose else 0), labels
+    order = []
+    remaining = list(range(len(stops)))
+    source = start
+    while remaining:
+        options = legs[source]
+        nearest = min(remaining, key=lambda i: options[stops[i]][0][0] \
+            if options[stops[i]] else INFINITY)
+        remaining.remove(nearest)
+        order.append(nearest)
+        source = stops[nearest]
+    best, labels = rank(order)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(len(order) - 1):
+            for j in range(i + 1, len(order)):
+                candidate = order[:i] + order[i:j + 1][::-1] + order[j + 1:]
+                candidateRank, candidateLabels = rank(candidate)
+                if candidateRank < best:
+                    order, best, labels = candidate, candidateRank, candidateLabels
+                    improved = True
+    return labels
+
+def planItinerary(digraph, start, stops, end = None, maxTotalDist = INFINITY, maxDistOutdoors = INFINITY, processes = None):
+    """
+    Finds the shortest trip from start that visits every one of stops, in
+    whichever order is best, with both constraints applied to the whole
+    trip rather than to each leg.
+
+    Parameters:
+        digraph: instance of class WeightedDigraph or CompactDigraph
+        start: start building number (string)
+        stops: building numbers (strings) to visit, in any order
+        end: optional building number to finish at after the last stop
+        maxTotalDist : optional maximum total distance of the trip
+        maxDistOutdoors: optional maximum distance spent outdoors on the trip
+        processes: if more than 1, search for the legs out of each stop in
+            this many worker processes
+
+    Assumes:
+        Up to ITINERARY_EXACT_STOPS stops the order found is the best one;
+        past that it comes from a heuristic and may not be.
+
+    Returns:
+        A tuple (order, path, total, outdoor): the stops in the order they
+        are visited, the whole trip as a list of building numbers (strings),
+        and its total and outdoor distances. Raises a ValueError if a
+        building is unknown or no trip satisfies the constraints.
+    """
+    graph = digraph.toCompact()
+    stops = list(stops)
+    for name in [start] + stops + ([] if end is None else [end]):
+        if not graph.hasNodeName(name):
+            raise ValueError('Unknown building {0}'.format(name))
+    sources = list(dict.fromkeys([start] + stops))
+    dests = list(dict.fromkeys(stops + ([] if end is None else [end])))
+    if processes is not None and processes > 1:
+        pool = SearchPool(digraph, processes)
+        try:
+            legs = pool.legs(sources, dests, maxTotalDist, maxDistOutdoors)
+        finally:
+            pool.close()
     else:
-        return shortest
-    
+        legs = {} ## stores source:{dest:[(total, outdoor, path), ...]}
+        for source in sources:
+            legs[source] = stopLegs(graph, source, dests, maxTotalDist, \
+                maxDistOutdoors)
+    if len(stops) <= ITINERARY_EXACT_STOPS:
+        labels = exactItinerary(legs, start, stops, end, maxTotalDist, \
+            maxDistOutdoors)
+    else:
+        labels = heuristicItinerary(legs, start, stops, end, maxTotalDist, \
+            maxDistOutdoors)
+    if not labels:
+        raise ValueError("No trip satisfies the constraints")
+    total, outdoor, chain = labels[0]
+    steps = [] ## (stop position, leg) pairs, last leg first
+    while chain is not None:
+        chain, i, leg = chain
+        steps.append((i, leg))
+    steps.reverse()
+    order = [stops[i] for i, leg in steps if i != -1]
+    path = [start]
+    for i, leg in steps:
+        path.extend(leg[2][1:])
+    return order, path, total, outdoor
 
 
 #### NOTE! These tests may take a few minutes to run!! ####
@@ -263,7 +1538,256 @@ if __name__ == '__main__':
     print('nodes', mitMap.nodes)
     print('edges', mitMap.edges)
     LARGE_DIST = 1000000
-    
+
+    # Zero-length edges: one side of the bidirectional search runs dry
+    # before the two sides meet
+    map7 = load_map("map7.txt")
+    print(bidirectionalSearch(map7, "1", "2", 0, 0))
+    print(bidirectionalSearch(map7, "1", "3", 0, 0))
+    print(bidirectionalSearch(map7, "1", "3", LARGE_DIST, LARGE_DIST))
+    #~ ['1', '2']
+    #~ ['1', '2', '3']
+    #~ ['1', '2', '3']
+
+    # The faster searches must agree with bruteForceSearch (same total, or
+    # both raising ValueError) on every query of the small maps, and on the
+    # course queries of mit_map
+    budgets = [(LARGE_DIST, LARGE_DIST), (18, 18), (18, 0), (15, 15), \
+        (10, 10), (35, 8), (21, 1), (8, 2), (1, 1), (0, 0)]
+    testMaps = {"mit_map.txt": mitMap}
+    testQueries = {"mit_map.txt": [('32', '56', LARGE_DIST, LARGE_DIST), \
+        ('32', '56', LARGE_DIST, 0), ('2', '9', LARGE_DIST, LARGE_DIST), \
+        ('2', '9', LARGE_DIST, 0), ('1', '32', LARGE_DIST, LARGE_DIST), \
+        ('1', '32', LARGE_DIST, 0), ('8', '50', LARGE_DIST, 0), \
+        ('10', '32', 100, 0)]}
+    for mapFilename in ("map2.txt", "map3.txt", "map5.txt", "map6.txt", \
+        "map7.txt", "map8.txt"):
+        testMaps[mapFilename] = load_map(mapFilename)
+        names = sorted(str(node) for node in testMaps[mapFilename].nodes)
+        testQueries[mapFilename] = [(start, end) + budget \
+            for start in names for end in names for budget in budgets]
+    expected = {} ## stores mapFilename:bruteForceSearch total (or None) per query
+    for mapFilename in testMaps:
+        expected[mapFilename] = []
+        for query in testQueries[mapFilename]:
+            try:
+                expected[mapFilename].append(testMaps[mapFilename].\
+                    getTotalDistance(bruteForceSearch(testMaps[mapFilename], *query)))
+            except ValueError:
+                expected[mapFilename].append(None)
+
+    def eachQuery(searchFn):
+        # Runs searchFn on one query at a time, for countMismatches
+        def searchAll(digraph, queries):
+            paths = []
+            for query in queries:
+                try:
+                    paths.append(searchFn(digraph, *query))
+                except ValueError:
+                    paths.append(None)
+            return paths
+        return searchAll
+
+    def countMismatches(searchAll):
+        # searchAll(digraph, queries) gives a path, or None for no path, per
+        # query. Counts the answers that break the query's constraints or
+        # disagree with bruteForceSearch
+        mismatches = 0
+        for mapFilename in testMaps:
+            digraph = testMaps[mapFilename]
+            paths = searchAll(digraph, testQueries[mapFilename])
+            for query, path, total in zip(testQueries[mapFilename], paths, \
+                expected[mapFilename]):
+                if path is not None:
+                    if path[0] != query[0] or path[-1] != query[1] or not \
+                        digraph.pathMeetsBothConstraints(path, *query[2:]):
+                        path = 'invalid'
+                    else:
+                        path = digraph.getTotalDistance(path)
+                if path != total:
+                    mismatches += 1
+        return mismatches
+
+    print('labelSettingSearch', countMismatches(eachQuery(labelSettingSearch)))
+    #~ labelSettingSearch 0
+    print('batchSearch', countMismatches(lambda digraph, queries: \
+        [result.getPath() for result in batchSearch(digraph, queries)]))
+    #~ batchSearch 0
+
+    def simplePaths(digraph, path, end):
+        # Yields every path from path[-1] to end that never visits a
+        # building twice, extending path, as (path, total, outdoor)
+        if path[-1] == end:
+            yield path, digraph.getTotalDistance(path), \
+                digraph.getOutdoorDistance(path)
+            return
+        for child in digraph.childrenOf(digraph.getNode(path[-1])):
+            if str(child) not in path:
+                for found in simplePaths(digraph, path + [str(child)], end):
+                    yield found
+
+    # The frontier must hold exactly the Pareto-optimal (total, outdoor)
+    # pairs of the simple paths within the budgets, each with a path that
+    # has those distances; and the best route on it for some budgets must be
+    # the one bruteForceSearch finds
+    mismatches = 0
+    for mapFilename in ("map2.txt", "map3.txt", "map5.txt", "map6.txt", \
+        "map7.txt", "map8.txt"):
+        digraph = testMaps[mapFilename]
+        names = sorted(str(node) for node in digraph.nodes)
+        for start in names:
+            for end in names:
+                routes = sorted((total, outdoor) for path, total, outdoor \
+                    in simplePaths(digraph, [start], end))
+                for maxTotalDist, maxDistOutdoors in budgets:
+                    optimal = []
+                    for total, outdoor in routes:
+                        if total <= maxTotalDist and outdoor <= maxDistOutdoors \
+                            and (not optimal or outdoor < optimal[-1][1]):
+                            optimal.append((total, outdoor))
+                    frontier = paretoFrontier(digraph, start, end, \
+                        maxTotalDist, maxDistOutdoors)
+                    if [(total, outdoor) for path, total, outdoor in frontier] \
+                        != optimal:
+                        mismatches += 1
+                    for path, total, outdoor in frontier:
+                        if (digraph.getTotalDistance(path), \
+                            digraph.getOutdoorDistance(path)) != (total, outdoor):
+                            mismatches += 1
+    print('paretoFrontier', mismatches, countMismatches(eachQuery(\
+        lambda digraph, start, end, maxTotalDist, maxDistOutdoors: bestOnFrontier(\
+        paretoFrontier(digraph, start, end), maxTotalDist, maxDistOutdoors))))
+    #~ paretoFrontier 0 0
+
+    # The k shortest routes must be k different simple paths within the
+    # budgets, with the k smallest totals of all such paths
+    mismatches = 0
+    for mapFilename in ("map2.txt", "map3.txt", "map5.txt", "map6.txt", \
+        "map7.txt", "map8.txt"):
+        digraph = testMaps[mapFilename]
+        names = sorted(str(node) for node in digraph.nodes)
+        for start in names:
+            for end in names:
+                routes = list(simplePaths(digraph, [start], end))
+                for maxTotalDist, maxDistOutdoors in budgets:
+                    totals = sorted(total for path, total, outdoor in routes \
+                        if total <= maxTotalDist and outdoor <= maxDistOutdoors)
+                    found = kShortestPaths(digraph, start, end, 3, \
+                        maxTotalDist, maxDistOutdoors)
+                    if [total for path, total, outdoor in found] != totals[:3] \
+                        or len(set(tuple(path) for path, total, outdoor \
+                        in found)) != len(found):
+                        mismatches += 1
+                    for path, total, outdoor in found:
+                        if len(set(path)) != len(path) or \
+                            (path[0], path[-1]) != (start, end) or \
+                            digraph.getTotalDistance(path) != total or \
+                            digraph.getOutdoorDistance(path) != outdoor:
+                            mismatches += 1
+
+    def firstShortestPath(digraph, start, end, maxTotalDist, maxDistOutdoors):
+        # The first of kShortestPaths, raising ValueError like the searches
+        found = kShortestPaths(digraph, start, end, 1, maxTotalDist, \
+            maxDistOutdoors)
+        if not found:
+            raise ValueError("No path satisfies the constraints")
+        return found[0][0]
+    print('kShortestPaths', mismatches, \
+        countMismatches(eachQuery(firstShortestPath)))
+    #~ kShortestPaths 0 0
+
+    # Each building reachable within the budgets must have the
+    # bruteForceSearch total, and with frontier set the pairs paretoFrontier
+    # finds; no other building may be reachable
+    mismatches = 0
+    for mapFilename in testMaps:
+        digraph = testMaps[mapFilename]
+        for query, total in zip(testQueries[mapFilename], expected[mapFilename]):
+            start, end, maxTotalDist, maxDistOutdoors = query
+            reachable = reachableWithin(digraph, start, maxTotalDist, \
+                maxDistOutdoors)
+            frontier = reachableWithin(digraph, start, maxTotalDist, \
+                maxDistOutdoors, frontier = True)
+            if end not in reachable:
+                if total is not None or end in frontier:
+                    mismatches += 1
+            elif reachable[end][0] != total or frontier[end] != [(found, \
+                outdoor) for path, found, outdoor in paretoFrontier(digraph, \
+                start, end, maxTotalDist, maxDistOutdoors)]:
+                mismatches += 1
+    print('reachableWithin', mismatches)
+    #~ reachableWithin 0
+
+    # A* must find the bruteForceSearch total wherever the buildings are,
+    # since the scale keeps straight-line distance a lower bound
+    import random
+    positions = random.Random(6002)
+    coordinates = {} ## stores digraph:Coordinates for each test map
+    for digraph in testMaps.values():
+        coordinates[digraph] = Coordinates(dict((str(node), \
+            (positions.uniform(0, 100), positions.uniform(0, 100))) \
+            for node in digraph.nodes))
+    print('aStarSearch', countMismatches(eachQuery(lambda digraph, *query: \
+        aStarSearch(digraph, coordinates[digraph], *query))))
+    #~ aStarSearch 0
+
+    # An itinerary must visit its stops in the order it gives, along real
+    # edges and within the trip budgets, and be as short as the best trip
+    # made of Pareto-optimal legs over every order of the stops
+    import itertools
+    def bestTrip(digraph, start, stops, end, maxTotalDist, maxDistOutdoors):
+        # The least total of a trip within the budgets, or None
+        best = None
+        for order in itertools.permutations(stops):
+            visits = [start] + list(order) + ([] if end is None else [end])
+            trips = [(0, 0)]
+            for i in range(len(visits) - 1):
+                legs = paretoFrontier(digraph, visits[i], visits[i+1])
+                trips = [(total + legTotal, outdoor + legOutdoor) \
+                    for total, outdoor in trips \
+                    for path, legTotal, legOutdoor in legs]
+            for total, outdoor in trips:
+                if total <= maxTotalDist and outdoor <= maxDistOutdoors and \
+                    (best is None or total < best):
+                    best = total
+        return best
+    itineraries = [(mitMap, '1', ['32', '56', '9'], None, LARGE_DIST, LARGE_DIST, None), \
+        (mitMap, '32', ['2', '9'], '32', LARGE_DIST, 0, None), \
+        (mitMap, '32', ['2', '9'], '32', 700, 100, 2)]
+    for mapFilename in ("map2.txt", "map3.txt", "map5.txt", "map6.txt", \
+        "map7.txt", "map8.txt"):
+        digraph = testMaps[mapFilename]
+        names = sorted(str(node) for node in digraph.nodes)
+        for start in names:
+            others = [name for name in names if name != start]
+            for stops in itertools.combinations(others, 2):
+                for end in (None, start):
+                    for maxTotalDist, maxDistOutdoors in budgets:
+                        itineraries.append((digraph, start, list(stops), end, \
+                            maxTotalDist, maxDistOutdoors, None))
+    mismatches = 0
+    for digraph, start, stops, end, maxTotalDist, maxDistOutdoors, processes \
+        in itineraries:
+        best = bestTrip(digraph, start, stops, end, maxTotalDist, maxDistOutdoors)
+        try:
+            order, path, total, outdoor = planItinerary(digraph, start, stops, \
+                end, maxTotalDist, maxDistOutdoors, processes)
+        except ValueError:
+            if best is not None:
+                mismatches += 1
+            continue
+        visits = [start] + order + ([] if end is None else [end])
+        remaining = iter(path)
+        if total != best or sorted(order) != sorted(stops) or \
+            path[0] != start or path[-1] != visits[-1] or \
+            not all(visit in remaining for visit in visits) or \
+            digraph.getTotalDistance(path) != total or \
+            digraph.getOutdoorDistance(path) != outdoor or \
+            total > maxTotalDist or outdoor > maxDistOutdoors:
+            mismatches += 1
+    print('planItinerary', mismatches)
+    #~ planItinerary 0
+
     # Uncomment below when ready to test
     
     #~ User Test case A